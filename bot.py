@@ -1,18 +1,24 @@
 # -*- coding: utf-8 -*-
+import time
+# Точка отсчёта для замеров времени старта (до тяжёлых импортов)
+_PROCESS_START = time.monotonic()
+
 import os
 import asyncio
-import docker
+import contextlib
+import hashlib
 import html
-import shutil 
+import secrets
+import signal
+import ssl
+import tempfile
 from datetime import datetime, timezone 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, TypeHandler
+from telegram.error import BadRequest
 from dotenv import load_dotenv
 from typing import Optional # Добавлен для Optional
 import logging
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
-import pytz
 
 
 
@@ -22,13 +28,84 @@ logging.basicConfig(level=logging.INFO,
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
 
-# ИМПОРТИРУЙТЕ ВАШУ ЛОГИКУ ШИФРОВАНИЯ
-# Убедитесь, что файл cipher_logic.py находится в той же папке
-try:
-    from cipher_logic import AESGCMCipher
-except ImportError:
-    logging.info("❌ Ошибка: Не найден модуль cipher_logic.py. Функции шифрования не будут работать.")
-    AESGCMCipher = None
+def _log_startup_phase(phase: str):
+    """Пишет в лог время от запуска процесса до указанной фазы старта."""
+    logging.info(f"⏱ Старт: {phase} — {time.monotonic() - _PROCESS_START:.2f} сек")
+
+
+def _load_cipher_logic():
+    """
+    Ленивая загрузка логики шифрования (pycryptodome заметно замедляет старт),
+    модуль импортируется при первой архивации.
+    Убедитесь, что файл cipher_logic.py находится в той же папке.
+    """
+    try:
+        import cipher_logic
+    except ImportError:
+        logging.info("❌ Ошибка: Не найден модуль cipher_logic.py. Функции шифрования не будут работать.")
+        return None
+    return cipher_logic
+
+
+from tree_scanner import scan_tree, write_zip, load_exclude_patterns
+from s3_uploader import S3Client, S3MultipartUpload
+from container_watchdog import ContainerWatchdog
+from webhook_server import WebhookServer
+from task_manager import TaskManager, BackgroundTask, MessageLocks
+from docker_supervisor import DockerSupervisor
+from log_bundle import write_log_bundle
+
+_log_startup_phase("импорт модулей")
+
+
+class _TeeWriter:
+    """Раздаёт один зашифрованный поток нескольким получателям (файл, S3 и т.п.).
+
+    Ошибка одного получателя не прерывает запись в остальные: он запоминается в failed
+    и отключается. Исключение — только когда не осталось ни одного получателя.
+    """
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+        self.failed = {}
+
+    def _call(self, method, *args):
+        for sink in list(self.sinks):
+            try:
+                getattr(sink, method)(*args)
+            except Exception as e:
+                logging.error(f"Получатель бэкапа {type(sink).__name__} отключён: {e}")
+                self.failed[sink] = e
+                self.sinks.remove(sink)
+        if not self.sinks:
+            errors = "; ".join(str(e) for e in self.failed.values())
+            raise Exception(f"Все получатели бэкапа завершились с ошибкой: {errors}")
+
+    def write(self, data):
+        self._call('write', data)
+        return len(data)
+
+    def flush(self):
+        self._call('flush')
+
+
+class _SizeLimitedWriter:
+    """Передаёт запись в sink и прерывает её, как только объём превысит limit байт."""
+
+    def __init__(self, sink, limit: int, message: str):
+        self.sink = sink
+        self.limit = limit
+        self.message = message
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        if self.written > self.limit:
+            raise Exception(self.message)
+        return self.sink.write(data)
+
+    def flush(self):
+        self.sink.flush()
 
 
 load_dotenv()
@@ -43,6 +120,62 @@ class DockerBot:
         self.iter_password = os.getenv("ITERATIONS_PASSWORD", "")
         # Используем путь внутри контейнера, указанный в .env
         self.folder_to_archive = os.getenv("FOLDER_TO_ARCHIVE") or "/app/data_to_archive"
+
+        # KDF: legacy (старый формат PBKDF2-SHA1, по умолчанию) либо scrypt / pbkdf2_sha256 / argon2id
+        self.kdf_algorithm = os.getenv("KDF_ALGORITHM", "legacy").strip().lower()
+        self.kdf_target_seconds = float(os.getenv("KDF_TARGET_SECONDS", "1.0"))
+        self.kdf_max_memory_mb = int(os.getenv("KDF_MAX_MEMORY_MB", "64"))
+        self.kdf_cache_file = os.getenv("KDF_CACHE_FILE") or "logs/kdf_calibration.json"
+
+        # Исключения при архивации (gitignore-стиль): через запятую + файл .backupignore
+        self.backup_exclude = os.getenv("BACKUP_EXCLUDE", "")
+        self.backup_ignore_file = os.getenv("BACKUP_IGNORE_FILE") or None
+
+        # Куда отправлять автоматический бэкап: telegram, s3 или оба (через запятую)
+        self.backup_destinations = [
+            d.strip().lower() for d in os.getenv("BACKUP_DESTINATIONS", "telegram").split(',') if d.strip()
+        ]
+
+        # --- S3-совместимое хранилище (MinIO, AWS S3 и т.п.) ---
+        self.s3_endpoint = os.getenv("S3_ENDPOINT", "")
+        self.s3_bucket = os.getenv("S3_BUCKET", "")
+        self.s3_access_key = os.getenv("S3_ACCESS_KEY", "")
+        self.s3_secret_key = os.getenv("S3_SECRET_KEY", "")
+        self.s3_region = os.getenv("S3_REGION", "us-east-1")
+        self.s3_prefix = os.getenv("S3_PREFIX", "")
+        self.s3_part_size_mb = int(os.getenv("S3_PART_SIZE_MB", "8"))
+        self.s3_concurrency = int(os.getenv("S3_CONCURRENCY", "4"))
+        self.s3_part_retries = int(os.getenv("S3_PART_RETRIES", "3"))
+
+        # --- Watchdog: автоперезапуск контейнеров с меткой WATCHDOG_LABEL ---
+        self.watchdog_enabled = os.getenv("WATCHDOG_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+        self.watchdog_label = os.getenv("WATCHDOG_LABEL", "docker-bot.watchdog=true")
+        self.watchdog = None
+
+        # --- Webhook (если WEBHOOK_URL не задан — long polling) ---
+        self.webhook_url = os.getenv("WEBHOOK_URL", "").strip().rstrip('/')
+        self.webhook_path = os.getenv("WEBHOOK_PATH", "/telegram")
+        self.webhook_listen = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+        self.webhook_port = int(os.getenv("WEBHOOK_PORT", "8080"))
+        # Если секрет не задан — генерируется при каждом запуске (Telegram получает его в setWebhook)
+        self.webhook_secret = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+        self.webhook_ssl_cert = os.getenv("WEBHOOK_SSL_CERT", "")
+        self.webhook_ssl_key = os.getenv("WEBHOOK_SSL_KEY", "")
+
+        # --- Параллельная обработка обновлений и фоновые задачи ---
+        self.concurrent_updates = int(os.getenv("CONCURRENT_UPDATES", "32"))
+        self.tasks = TaskManager()
+        self.message_locks = MessageLocks()
+        # Одновременно выполняется один бэкап: выработка ключа (scrypt/Argon2) и буферы частей S3
+        # двух параллельных бэкапов могут не уложиться в лимит памяти контейнера
+        self.backup_lock = asyncio.Lock()
+
+        # --- Сбор логов контейнеров ---
+        self.logs_concurrency = int(os.getenv("LOGS_CONCURRENCY", "4"))
+        self.logs_since_hours = int(os.getenv("LOGS_SINCE_HOURS", "24"))
+        # Лимит Telegram на отправку файла ботом (50 МБ; больше — только с локальным Bot API сервером)
+        self.telegram_upload_limit_mb = int(os.getenv("TELEGRAM_UPLOAD_LIMIT_MB", "50"))
+        self.log_selection = {}  # chat_id -> {'names': выбранные контейнеры, 'since_hours': период}
         
         # ------------------------------------
 
@@ -54,18 +187,18 @@ class DockerBot:
             os.makedirs(self.folder_to_archive, exist_ok=True)
             logging.info(f"Папка {self.folder_to_archive} не найдена. Создана пустая папка.")
 
-        try:
-            # Проверка, что Docker Socket смонтирован
-            if not os.path.exists('/var/run/docker.sock'):
-                raise Exception("Docker socket не найден: /var/run/docker.sock")
-
-            self.docker_client = docker.DockerClient(base_url='unix:///var/run/docker.sock')
-            self.docker_client.ping()
-            logging.info("Docker подключение успешно установлено")
-        except Exception as e:
-            logging.info(f"Ошибка подключения к Docker: {e}")
-            logging.info("Убедитесь, что Docker socket смонтирован в контейнер")
-            self.docker_client = None 
+        # Docker подключается в фоне (post_init): бот не ждёт сокет при старте,
+        # а функции Docker включаются, как только подключение установлено
+        self.docker_client = None
+        self.docker_supervisor = DockerSupervisor(
+            base_url=os.getenv("DOCKER_HOST") or "unix:///var/run/docker.sock",
+            on_change=self._on_docker_state_change,
+            check_interval=float(os.getenv("DOCKER_CHECK_INTERVAL", "30")),
+        )
+        self.application = None
+        self._first_update_logged = False
+        self._docker_connected_once = False
+        _log_startup_phase("инициализация DockerBot")
 
     # --- Вспомогательные функции ---
 
@@ -96,63 +229,174 @@ class DockerBot:
             else: return f"{seconds // 86400} д {(seconds % 86400) // 3600} ч"
         except Exception as e: return f"Raw: {started_at_str}"
 
-    async def create_archive_and_encrypt(self, folder_path: str, output_file: str) -> tuple[str, int]:
-        """Архивирует папку, шифрует архив и возвращает путь к зашифрованному файлу и итерации."""
-        if not AESGCMCipher:
+    def _format_size(self, size):
+        for unit in ("Б", "КБ", "МБ", "ГБ"):
+            if size < 1024 or unit == "ГБ":
+                return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+            size /= 1024
+
+    def _manual_action(self, container_name, stop: bool = False):
+        """Сообщает watchdog, что остановка/перезапуск контейнера выполняется намеренно (на время вызова)."""
+        if self.watchdog:
+            return self.watchdog.manual_action(container_name, stop=stop)
+        return contextlib.nullcontext()
+
+    def _on_docker_error(self, error):
+        """Обрыв связи с Docker (а не ответ API вроде NotFound) — внеочередная проверка подключения."""
+        from docker import errors as docker_errors
+        if not isinstance(error, docker_errors.APIError):
+            self.docker_supervisor.check_now()
+
+    def _get_kdf(self):
+        """Возвращает откалиброванный под хост KDF (None — старый формат PBKDF2-SHA1)."""
+        if self.kdf_algorithm == "legacy":
+            return None
+        cache_dir = os.path.dirname(self.kdf_cache_file)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        return _load_cipher_logic().calibrate_kdf(
+            self.kdf_algorithm,
+            target_seconds=self.kdf_target_seconds,
+            max_memory_mb=self.kdf_max_memory_mb,
+            cache_path=self.kdf_cache_file,
+        )
+
+    def _make_temp_file(self, suffix: str) -> str:
+        """Создаёт уникальный временный файл (параллельные задачи не пишут в один и тот же) и возвращает путь."""
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        return path
+
+    async def _make_cipher(self):
+        """AESGCMCipher с текущими паролями и KDF (проверяет, что шифрование доступно)."""
+        cipher_logic = await asyncio.to_thread(_load_cipher_logic)
+        if not cipher_logic:
             raise Exception("Модуль шифрования (cipher_logic.py) не загружен.")
         if not self.enc_password:
              raise Exception("Пароль шифрования (ENCRYPTION_PASSWORD) не установлен.")
 
-        current_dir = os.getcwd() 
-        temp_zip_path_base = os.path.join(current_dir, os.path.basename(folder_path))
-        
+        # Калибровка (один раз на хост) и выработка ключа — тяжёлые, выносим из event loop
+        kdf = await asyncio.to_thread(self._get_kdf)
+        return cipher_logic.AESGCMCipher(self.enc_password, self.iter_password, kdf=kdf)
+
+    async def scan_backup_folder(self, folder_path: str):
+        """Сканирует папку с учётом исключений: список файлов, их число и общий размер."""
+        patterns = load_exclude_patterns(folder_path, self.backup_exclude, self.backup_ignore_file)
+        scan = await asyncio.to_thread(scan_tree, folder_path, patterns)
+        logging.info(
+            f"Сканирование {folder_path}: {scan.file_count} файлов, {self._format_size(scan.total_bytes)}, "
+            f"исключено: {scan.excluded_count}"
+        )
+        return scan
+
+    async def encrypt_folder_to(self, folder_path: str, sink, scan=None) -> int:
+        """Архивирует и шифрует папку за один проход, записывая зашифрованный поток в sink.
+
+        sink — любой объект с write() (файл, S3MultipartUpload, _TeeWriter).
+        Ни ZIP, ни зашифрованный архив целиком не хранятся в памяти.
+        Возвращает итерации (или стоимость KDF).
+        """
+        cipher = await self._make_cipher()
+
+        if scan is None:
+            scan = await self.scan_backup_folder(folder_path)
+
+        def _archive_and_encrypt():
+            with cipher.encrypt_stream(sink) as encrypted:
+                write_zip(scan, encrypted, os.path.basename(folder_path))
+            return encrypted.iterations
+
         try:
-            shutil.make_archive(
-                base_name=temp_zip_path_base,
-                format='zip', 
-                root_dir=os.path.dirname(folder_path), 
-                base_dir=os.path.basename(folder_path)
-            )
-            temp_zip_path = temp_zip_path_base + ".zip"
+            return await asyncio.to_thread(_archive_and_encrypt)
         except Exception as e:
             logging.info(f"Ошибка архивирования: {e}")
             raise
 
+    async def create_archive_and_encrypt(self, folder_path: str, output_file: str, scan=None) -> tuple[str, int]:
+        """Архивирует папку, шифрует архив и возвращает путь к зашифрованному файлу и итерации.
+
+        scan — результат scan_backup_folder; если не передан, папка сканируется здесь.
+        """
         try:
-            with open(temp_zip_path, 'rb') as f:
-                archive_data = f.read()
-        finally:
-            if os.path.exists(temp_zip_path):
-                os.remove(temp_zip_path)
+            with open(output_file, 'wb') as f:
+                iterations = await self.encrypt_folder_to(folder_path, f, scan=scan)
+        except BaseException:
+            # BaseException — в том числе отмена задачи (CancelledError)
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise
 
-        cipher = AESGCMCipher(self.enc_password, self.iter_password)
-        encrypted_data, iterations = cipher.encrypt(archive_data, iterations=None) 
+        return output_file, iterations
 
-        with open(output_file, 'wb') as f:
-            f.write(encrypted_data)
+    async def create_log_bundle(self, output_file: str, names=None, since_hours: int = 0, progress=None,
+                                max_bytes: Optional[int] = None) -> dict:
+        """Собирает логи контейнеров в tar.gz и шифрует его за один проход в output_file.
 
-        return output_file, iterations
+        names — имена контейнеров (пусто — все), since_hours — период в часах (0 — все логи).
+        Логи пишутся в архив по мере скачивания, целиком в памяти не хранятся.
+        max_bytes — предел размера файла: при превышении сбор прерывается сразу, а не после скачивания всех логов.
+        """
+        if not self.docker_client:
+            raise Exception("Docker клиент недоступен.")
+        cipher = await self._make_cipher()
+        since = int(time.time() - since_hours * 3600) if since_hours else None
+
+        try:
+            with open(output_file, 'wb') as f:
+                sink = f
+                if max_bytes:
+                    sink = _SizeLimitedWriter(
+                        f, max_bytes,
+                        f"Архив логов превысил лимит Telegram на отправку файла ({self._format_size(max_bytes)}). "
+                        f"Выберите меньший период или меньше контейнеров."
+                    )
+                # Выработка ключа при создании потока — тяжёлая операция
+                encrypted = await asyncio.to_thread(cipher.encrypt_stream, sink)
+                with encrypted:
+                    return await write_log_bundle(
+                        self.docker_client, encrypted, names=names, since=since,
+                        concurrency=self.logs_concurrency, progress=progress
+                    )
+        except BaseException:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise
 
+    def _make_s3_client(self):
+        if not (self.s3_endpoint and self.s3_bucket and self.s3_access_key and self.s3_secret_key):
+            raise Exception("S3 не настроен: задайте S3_ENDPOINT, S3_BUCKET, S3_ACCESS_KEY и S3_SECRET_KEY.")
+        return S3Client(
+            self.s3_endpoint, self.s3_access_key, self.s3_secret_key, self.s3_bucket, region=self.s3_region
+        )
+
+
+
+    # --- Docker-функции ---
+    # Вызовы Docker SDK блокирующие — выполняем их в потоках, чтобы не останавливать event loop
 
+    def _image_tag(self, container):
+        if container.image.tags: return container.image.tags[0]
+        return container.image.short_id
 
-    # --- Docker-функции (не изменены) ---
     # остановка всех контейнеров
-    async def stop_all_containers(self):
+    async def stop_all_containers(self, progress=None):
         if not self.docker_client:
             return False
 
         try:
-            containers = self.docker_client.containers.list(all=True)
+            containers = await asyncio.to_thread(self.docker_client.containers.list, all=True)
 
-            for container in containers:
+            for index, container in enumerate(containers, 1):
                 # не останавливаем контейнер бота
                 if container.name in ["docker-bot", "tg_docker_bot"]:
                     logging.info(f"⏭ Пропуск контейнера бота: {container.name}")
                     continue
 
                 logging.info(f"⛔ Остановка: {container.name}")
+                if progress: progress(f"⛔ {index}/{len(containers)}: {container.name}")
                 try:
-                    container.stop()
+                    with self._manual_action(container.name, stop=True):
+                        await asyncio.to_thread(container.stop)
                 except Exception as e:
                     logging.error(f"Ошибка при остановке {container.name}: {e}")
 
@@ -162,25 +406,27 @@ class DockerBot:
 
         except Exception as e:
             logging.error(f"Критическая ошибка stop_all: {e}")
+            self._on_docker_error(e)
             return False
 
     # запуск всех контейнеров
-    async def start_all_containers(self):
+    async def start_all_containers(self, progress=None):
         if not self.docker_client:
             return False
 
         try:
-            containers = self.docker_client.containers.list(all=True)
+            containers = await asyncio.to_thread(self.docker_client.containers.list, all=True)
 
-            for container in containers:
+            for index, container in enumerate(containers, 1):
                 if container.name in ["docker-bot", "tg_docker_bot"]:
                     logging.info(f"⏭ Пропуск контейнера бота: {container.name}")
                     continue
 
                 logging.info(f"▶️ Запуск: {container.name}")
+                if progress: progress(f"▶️ {index}/{len(containers)}: {container.name}")
 
                 try:
-                    container.start()
+                    await asyncio.to_thread(container.start)
                 except Exception as e:
                     logging.error(f"Ошибка при запуске {container.name}: {e}")
 
@@ -190,30 +436,33 @@ class DockerBot:
 
         except Exception as e:
             logging.error(f"Критическая ошибка start_all: {e}")
+            self._on_docker_error(e)
             return False
 
 
 
 
     # перезапуск всех контейнеров
-    async def restart_all_containers(self):
+    async def restart_all_containers(self, progress=None):
         """Перезапускает все контейнеры, кроме контейнера самого бота."""
         if not self.docker_client:
             return False
         try:
-            containers = self.docker_client.containers.list(all=True)
+            containers = await asyncio.to_thread(self.docker_client.containers.list, all=True)
             container_names = [c.name for c in containers]
 
             logging.info(f"⏳ Запущена перезагрузка всех контейнеров: {', '.join(container_names)}")
 
-            for container in containers:
+            for index, container in enumerate(containers, 1):
                 # ❗️ НЕ перезапускаем контейнер бота, иначе код остановится
                 if container.name in ["docker-bot", "tg_docker_bot"]:
                     logging.info(f"⏭ Пропуск контейнера бота: {container.name}")
                     continue
 
                 logging.info(f"🔄 Перезапуск контейнера: {container.name}")
-                container.restart()
+                if progress: progress(f"🔄 {index}/{len(containers)}: {container.name}")
+                with self._manual_action(container.name):
+                    await asyncio.to_thread(container.restart)
                 await asyncio.sleep(1)  # небольшая задержка для стабильности
 
             logging.info("✅ Все контейнеры успешно перезапущены.")
@@ -221,65 +470,75 @@ class DockerBot:
 
         except Exception as e:
             logging.error(f"❌ Критическая ошибка при перезапуске всех контейнеров: {e}")
+            self._on_docker_error(e)
             return False
 
 
     async def get_containers(self):
         if not self.docker_client: return []
-        # ... (код get_containers)
-        try:
+
+        def _collect():
             containers = self.docker_client.containers.list(all=True)
             result = []
             for container in containers:
-                if container.image.tags: image_tag = container.image.tags[0]
-                else: image_tag = container.image.short_id
+                image_tag = self._image_tag(container)
                 started_at = None
                 try: started_at = container.attrs['State'].get('StartedAt')
                 except (KeyError, AttributeError): started_at = None
                 result.append({'name': container.name, 'status': container.status, 'image': image_tag, 'started_at': started_at})
             return result
+
+        try:
+            return await asyncio.to_thread(_collect)
         except Exception as e:
             logging.info(f"Ошибка при получении контейнеров: {e}")
+            self._on_docker_error(e)
             return []
 
     async def start_container(self, container_name):
         if not self.docker_client: return False
         try:
-            container = self.docker_client.containers.get(container_name)
-            container.start()
+            container = await asyncio.to_thread(self.docker_client.containers.get, container_name)
+            await asyncio.to_thread(container.start)
             return True
         except Exception as e:
             logging.info(f"Ошибка при запуске контейнера: {e}")
+            self._on_docker_error(e)
             return False
 
     async def stop_container(self, container_name):
         if not self.docker_client: return False
         try:
-            container = self.docker_client.containers.get(container_name)
-            container.stop()
+            container = await asyncio.to_thread(self.docker_client.containers.get, container_name)
+            with self._manual_action(container_name, stop=True):
+                await asyncio.to_thread(container.stop)
             return True
         except Exception as e:
             logging.info(f"Ошибка при остановке контейнера: {e}")
+            self._on_docker_error(e)
             return False
 
     async def restart_container(self, container_name):
         if not self.docker_client: return False
         try:
-            container = self.docker_client.containers.get(container_name)
-            container.restart()
+            container = await asyncio.to_thread(self.docker_client.containers.get, container_name)
+            with self._manual_action(container_name):
+                await asyncio.to_thread(container.restart)
             return True
         except Exception as e:
             logging.info(f"Ошибка при перезапуске контейнера: {e}")
+            self._on_docker_error(e)
             return False
 
     async def get_container_logs(self, container_name, lines=20):
         if not self.docker_client: return "Docker клиент недоступен."
         try:
-            container = self.docker_client.containers.get(container_name)
-            logs = container.logs(tail=lines).decode('utf-8')
+            container = await asyncio.to_thread(self.docker_client.containers.get, container_name)
+            logs = (await asyncio.to_thread(container.logs, tail=lines)).decode('utf-8')
             return logs
         except Exception as e:
             logging.info(f"Ошибка при получении логов: {e}")
+            self._on_docker_error(e)
             return f"Ошибка при получении логов: {self._escape_html(e)}"
 
     # --- Обработчики Telegram ---
@@ -291,11 +550,7 @@ class DockerBot:
             await update.message.reply_text("❌ У вас нет доступа к этому боту.")
             return
 
-        keyboard = [
-            [InlineKeyboardButton("📋 Список контейнеров", callback_data="list")],
-            [InlineKeyboardButton("🔒 Зашифровать архив", callback_data="encrypt_archive")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = self._main_menu_markup()
 
         await update.message.reply_text(
             "🐳 <b>Docker Bot</b>\n\nВыберите действие:",
@@ -307,85 +562,215 @@ class DockerBot:
         query = update.callback_query
         await query.answer()
 
-        if query.data == "list":
-            await self.show_containers(query)
-        elif query.data == "back":
-            await self.start_menu(query)
-        elif query.data == "encrypt_archive": 
-             await self.handle_encrypt_archive(query, context)
-        elif query.data.startswith("container_"):
-            await self.show_container_info(query)
-        elif query.data.startswith("action_"):
-            await self.handle_action(query)
-
-    async def start_menu(self, query):
-        """Показать главное меню"""
+        # Обновления обрабатываются параллельно; нажатия на одно и то же сообщение — по очереди
+        async with self.message_locks.get(query.message.chat_id, query.message.message_id):
+            if query.data == "list":
+                await self.show_containers(query)
+            elif query.data == "back":
+                await self.start_menu(query)
+            elif query.data == "encrypt_archive": 
+                 await self.handle_encrypt_archive(query, context)
+            elif query.data == "tasks":
+                await self.show_tasks(query)
+            elif query.data.startswith("task_cancel_"):
+                await self.handle_task_cancel(query)
+            elif query.data.startswith("container_"):
+                await self.show_container_info(query)
+            elif query.data.startswith("action_"):
+                await self.handle_action(query)
+            elif query.data.startswith("logs_"):
+                await self.handle_logs_menu(query, context)
+
+    def _main_menu_markup(self):
         keyboard = [
             [InlineKeyboardButton("📋 Список контейнеров", callback_data="list")],
             [InlineKeyboardButton("🔒 Зашифровать архив", callback_data="encrypt_archive")],
+            [InlineKeyboardButton("⚙️ Задачи", callback_data="tasks")],
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        return InlineKeyboardMarkup(keyboard)
+
+    async def start_menu(self, query):
+        """Показать главное меню"""
+        reply_markup = self._main_menu_markup()
 
         await query.edit_message_text(
             "🐳 <b>Docker Bot</b>\n\nВыберите действие:",
             reply_markup=reply_markup, parse_mode='HTML'
         )
     
+    # --- Фоновые задачи ---
+
+    def _task_markup(self, task):
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton(f"❌ Отменить #{task.id}", callback_data=f"task_cancel_{task.id}")],
+            [InlineKeyboardButton("⚙️ Задачи", callback_data="tasks")],
+            [InlineKeyboardButton("🔙 Назад", callback_data="back")],
+        ])
+
+    async def start_background_task(self, query, title: str, job, result_markup=None):
+        """
+        Запускает долгую операцию как фоновую задачу и сразу освобождает обработчик.
+        job(task, report) — корутина, возвращающая HTML-текст результата; по завершении
+        им редактируется исходное сообщение (с кнопками result_markup).
+        await report(text) — показать промежуточный результат в том же сообщении (с кнопкой отмены).
+        """
+        chat_id = query.message.chat_id
+        message_id = query.message.message_id
+        bot = query.get_bot()
+        result_markup = result_markup or self._main_menu_markup()
+
+        async def edit(text, reply_markup):
+            async with self.message_locks.get(chat_id, message_id):
+                try:
+                    await bot.edit_message_text(
+                        chat_id=chat_id, message_id=message_id, text=text,
+                        reply_markup=reply_markup, parse_mode='HTML'
+                    )
+                except Exception as e:
+                    logging.warning(f"Не удалось обновить сообщение задачи: {e}")
+
+        async def finish(text):
+            await edit(text, result_markup)
+
+        async def runner(task):
+            async def report(text):
+                await edit(f"⏳ <b>Задача #{task.id}</b>: {self._escape_html(title)}\n\n{text}", self._task_markup(task))
+
+            try:
+                text = await job(task, report)
+            except asyncio.CancelledError:
+                await finish(f"🚫 Задача #{task.id} ({self._escape_html(title)}) отменена.")
+                raise
+            except Exception as e:
+                await finish(f"❌ <b>Задача #{task.id}</b> ({self._escape_html(title)}):\n\n<code>{self._escape_html(e)}</code>")
+                raise
+            await finish(text)
+            return text
+
+        task = self.tasks.start(title, runner, chat_id, message_id)
+        await query.edit_message_text(
+            f"⏳ <b>Задача #{task.id}</b>: {self._escape_html(title)}\n\n"
+            f"Выполняется в фоне — бот остаётся доступен. Статус — в разделе «⚙️ Задачи».",
+            reply_markup=self._task_markup(task), parse_mode='HTML'
+        )
+        return task
+
+    async def show_tasks(self, query):
+        """Список фоновых задач со статусом и кнопками отмены."""
+        tasks = self.tasks.list()
+        icons = {
+            BackgroundTask.RUNNING: "⏳", BackgroundTask.DONE: "✅",
+            BackgroundTask.FAILED: "❌", BackgroundTask.CANCELLED: "🚫",
+        }
+
+        if not tasks:
+            message = "⚙️ <b>Фоновые задачи</b>\n\nЗадач нет."
+        else:
+            message = "⚙️ <b>Фоновые задачи</b>\n\n"
+            for task in tasks:
+                message += f"{icons[task.state]} <b>#{task.id}</b> {self._escape_html(task.title)} — {task.elapsed} сек\n"
+                if task.running:
+                    message += f"    {self._escape_html(task.status)}\n"
+
+        keyboard = [
+            [InlineKeyboardButton(f"❌ Отменить #{t.id}", callback_data=f"task_cancel_{t.id}")]
+            for t in tasks if t.running
+        ]
+        keyboard.append([InlineKeyboardButton("🔄 Обновить", callback_data="tasks")])
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back")])
+
+        try:
+            await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+        except BadRequest as e:
+            # "Message is not modified" при повторном нажатии "Обновить"
+            if "not modified" not in str(e).lower():
+                raise
+
+    async def handle_task_cancel(self, query):
+        try:
+            task_id = int(query.data.rsplit("_", 1)[1])
+        except ValueError:
+            await query.edit_message_text("❌ Ошибка: неверный номер задачи.", parse_mode='HTML')
+            return
+
+        task = self.tasks.get(task_id)
+        if self.tasks.cancel(task_id):
+            if (task.chat_id, task.message_id) == (query.message.chat_id, query.message.message_id):
+                # Отмена из сообщения самой задачи: его обновит сама задача по завершении,
+                # а для этого ей нужна блокировка сообщения, которую держит текущий обработчик —
+                # поэтому не ждём задачу здесь
+                return
+            # Сообщение самой задачи обновится по её завершении
+            await self.tasks.wait(task_id, timeout=1)
+        await self.show_tasks(query)
+
     async def handle_encrypt_archive(self, query, context: ContextTypes.DEFAULT_TYPE):
-        """Архивирует заданную папку, шифрует ее и отправляет в чат."""
+        """Архивирует заданную папку, шифрует ее и отправляет в чат (в фоновой задаче)."""
         
         if not self.enc_password:
             await query.edit_message_text("❌ Ошибка: Пароль шифрования (ENCRYPTION_PASSWORD) не задан в .env.", parse_mode='HTML')
             return
         
         folder_display_name = self._escape_html(os.path.basename(self.folder_to_archive))
-        
-        message = await query.edit_message_text(
-            f"⏳ Начинаю архивацию и шифрование папки <code>{folder_display_name}</code>...", 
-            parse_mode='HTML'
-        )
+        chat_id = query.message.chat_id
+
+        async def job(task, report):
+            if self.backup_lock.locked():
+                task.set_status("⏳ Ожидание завершения другого бэкапа...")
+                await report("⏳ Ожидание завершения другого бэкапа...")
+            await self.backup_lock.acquire()
 
-        output_filename = ""
-        encrypted_filepath = ""
-        try:
             server_names_env = os.getenv("server_names_env")
             timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
             output_filename = f"{server_names_env}-{timestamp}.zip.enc"
-            
-            encrypted_filepath, iterations = await self.create_archive_and_encrypt(
-                self.folder_to_archive, 
-                os.path.join(os.getcwd(), output_filename)
-            )
+            encrypted_filepath = ""
+            try:
+                # Уникальный временный файл; имя с отметкой времени — только для Telegram.
+                # Путь известен до начала записи — при отмене частичный файл удаляется в finally
+                encrypted_filepath = self._make_temp_file(".zip.enc")
+
+                # Предварительная оценка объёма до начала долгой архивации
+                task.set_status("🔍 Сканирование папки...")
+                scan = await self.scan_backup_folder(self.folder_to_archive)
+                task.set_status(
+                    f"📦 Архивация и шифрование: {scan.file_count} файлов, {self._format_size(scan.total_bytes)} "
+                    f"(исключено: {scan.excluded_count})"
+                )
+                await report(
+                    f"Архивация папки <code>{folder_display_name}</code>...\n\n"
+                    f"📦 Файлов: {scan.file_count}\n"
+                    f"💾 Объём: {self._format_size(scan.total_bytes)}\n"
+                    f"🚫 Исключено: {scan.excluded_count}"
+                )
+                
+                encrypted_filepath, iterations = await self.create_archive_and_encrypt(
+                    self.folder_to_archive, 
+                    encrypted_filepath,
+                    scan=scan
+                )
 
-            await context.bot.send_document(
-                chat_id=query.message.chat_id,
-                document=encrypted_filepath,
-                caption=(
-                    f"✅ <b>Архив зашифрован!</b>\n\n"
-                ),
-                parse_mode='HTML'
-            )
-            
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=message.message_id,
-                text=f"✅ Архив успешно зашифрован и отправлен.",
-                parse_mode='HTML'
-            )
+                task.set_status("📤 Отправка архива...")
+                await context.bot.send_document(
+                    chat_id=chat_id,
+                    document=encrypted_filepath,
+                    filename=output_filename,
+                    caption=(
+                        f"✅ <b>Архив зашифрован!</b>\n\n"
+                        f"📁 Папка: <code>{folder_display_name}</code>\n"
+                        f"📦 Файлов: {scan.file_count}, {self._format_size(scan.total_bytes)}"
+                    ),
+                    parse_mode='HTML'
+                )
+            except Exception as e:
+                raise Exception(f"При архивации/шифровании: {e}") from e
+            finally:
+                if encrypted_filepath and os.path.exists(encrypted_filepath):
+                    os.remove(encrypted_filepath)
+                self.backup_lock.release()
 
-        except Exception as e:
-            error_message = self._escape_html(f"При архивации/шифровании: {e}")
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=message.message_id,
-                text=f"❌ **Критическая ошибка:**\n\n<code>{error_message}</code>",
-                parse_mode='HTML'
-            )
-        finally:
-            if encrypted_filepath and os.path.exists(encrypted_filepath):
-                os.remove(encrypted_filepath)
+            return "✅ Архив успешно зашифрован и отправлен.\n\n🐳 <b>Docker Bot</b>\n\nВыберите действие:"
 
-        await self.start_menu(query)
+        await self.start_background_task(query, f"Архивация {os.path.basename(self.folder_to_archive)}", job)
     
     async def show_containers(self, query):
         """Display the list of containers including status, image, and uptime."""
@@ -443,6 +828,7 @@ class DockerBot:
             [InlineKeyboardButton("🔄 Перезапустить все", callback_data="action_restart_all")],
             [InlineKeyboardButton("⛔ Остановить все", callback_data="action_stop_all")],
             [InlineKeyboardButton("▶️ Запустить все", callback_data="action_start_all")],
+            [InlineKeyboardButton("📦 Собрать логи", callback_data="logs_menu")],
             [InlineKeyboardButton("🔙 Назад", callback_data="back")]
         ]
 
@@ -458,9 +844,128 @@ class DockerBot:
 
 
 
+    def _name_key(self, name: str) -> str:
+        """Короткий ключ имени контейнера для callback_data (лимит Telegram — 64 байта)."""
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+
+    async def show_logs_menu(self, query):
+        """Выбор контейнеров и периода для сбора логов."""
+        if not self.docker_client:
+            return await self.start_menu(query)
+
+        selection = self.log_selection.setdefault(
+            query.message.chat_id, {'names': set(), 'since_hours': self.logs_since_hours}
+        )
+        containers = await self.get_containers()
+        # Контейнеры, удалённые с момента выбора, не учитываем
+        selection['names'] &= {c['name'] for c in containers}
+
+        names = selection['names']
+        since_hours = selection['since_hours']
+        message = "📦 <b>Сбор логов</b>\n\n"
+        message += f"Контейнеры: {'выбрано ' + str(len(names)) if names else 'все'}\n"
+        message += f"Период: {f'последние {since_hours} ч' if since_hours else 'все логи'}\n\n"
+        message += "Логи будут упакованы в tar.gz, зашифрованы и отправлены одним файлом."
+
+        keyboard = [
+            [InlineKeyboardButton(
+                f"{'✅' if c['name'] in names else '⬜'} {c['name']}",
+                callback_data=f"logs_toggle_{self._name_key(c['name'])}"
+            )]
+            for c in containers
+        ]
+        keyboard.append([
+            InlineKeyboardButton(
+                f"{'• ' if hours == since_hours else ''}{f'{hours} ч' if hours else 'Всё'}",
+                callback_data=f"logs_since_{hours}"
+            )
+            for hours in (1, 6, 24, 0)
+        ])
+        if names:
+            keyboard.append([InlineKeyboardButton("☑️ Все контейнеры", callback_data="logs_all")])
+        keyboard.append([InlineKeyboardButton("📦 Собрать", callback_data="logs_collect")])
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="list")])
+
+        try:
+            await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+
+    async def handle_logs_menu(self, query, context: ContextTypes.DEFAULT_TYPE):
+        """Кнопки меню сбора логов: выбор контейнеров/периода и запуск сбора."""
+        data = query.data
+        selection = self.log_selection.setdefault(
+            query.message.chat_id, {'names': set(), 'since_hours': self.logs_since_hours}
+        )
+
+        if data.startswith("logs_toggle_"):
+            key = data[len("logs_toggle_"):]
+            containers = await self.get_containers()
+            names = [c['name'] for c in containers if self._name_key(c['name']) == key]
+            selection['names'] ^= set(names)
+        elif data.startswith("logs_since_"):
+            try:
+                selection['since_hours'] = int(data[len("logs_since_"):])
+            except ValueError:
+                pass
+        elif data == "logs_all":
+            selection['names'].clear()
+        elif data == "logs_collect":
+            return await self.handle_collect_logs(query, context, set(selection['names']), selection['since_hours'])
+
+        await self.show_logs_menu(query)
+
+    async def handle_collect_logs(self, query, context: ContextTypes.DEFAULT_TYPE, names: set, since_hours: int):
+        """Собирает логи контейнеров, шифрует и отправляет одним файлом (в фоновой задаче)."""
+        if not self.enc_password:
+            await query.edit_message_text("❌ Ошибка: Пароль шифрования (ENCRYPTION_PASSWORD) не задан в .env.", parse_mode='HTML')
+            return
+
+        chat_id = query.message.chat_id
+        period = f"последние {since_hours} ч" if since_hours else "все логи"
+
+        async def job(task, report):
+            server_names_env = os.getenv("server_names_env", "backup")
+            timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            output_filename = f"{server_names_env}-logs-{timestamp}.tar.gz.enc"
+            output_file = ""
+            try:
+                # Уникальный временный файл; имя с отметкой времени — только для Telegram
+                output_file = self._make_temp_file(".tar.gz.enc")
+                task.set_status("🔐 Подготовка шифрования...")
+                result = await self.create_log_bundle(
+                    output_file, names, since_hours, progress=task.set_status,
+                    max_bytes=self.telegram_upload_limit_mb * 1024 * 1024
+                )
+                size = os.path.getsize(output_file)
+
+                task.set_status(f"📤 Отправка архива логов ({self._format_size(size)})...")
+                caption = (
+                    f"📦 <b>Логи контейнеров</b>\n\n"
+                    f"🐳 Контейнеров: {result['containers']}\n"
+                    f"🕒 Период: {period}\n"
+                    f"📄 Объём логов: {self._format_size(result['bytes'])}, архив: {self._format_size(size)}"
+                )
+                if result['errors']:
+                    caption += f"\n⚠️ Не удалось получить: {self._escape_html(', '.join(sorted(result['errors'])))}"
+                await context.bot.send_document(
+                    chat_id=chat_id, document=output_file, filename=output_filename, caption=caption, parse_mode='HTML'
+                )
+            finally:
+                if output_file and os.path.exists(output_file):
+                    os.remove(output_file)
+
+            return "✅ Логи собраны, зашифрованы и отправлены.\n\n🐳 <b>Docker Bot</b>\n\nВыберите действие:"
+
+        title = f"Сбор логов ({len(names) if names else 'все'}, {period})"
+        await self.start_background_task(query, title, job)
+
     async def show_container_info(self, query, container_name: Optional[str] = None):
         """Показать информацию о контейнере."""
         if not self.docker_client: return await self.start_menu(query)
+        # docker к этому моменту уже загружен DockerSupervisor
+        from docker import errors as docker_errors
         
         # ⬇️ ИСПРАВЛЕНИЕ 1 (часть 2): Парсим имя, если оно не было передано явно
         if not container_name:
@@ -470,11 +975,10 @@ class DockerBot:
                 return
 
         try:
-            container = self.docker_client.containers.get(container_name)
+            container = await asyncio.to_thread(self.docker_client.containers.get, container_name)
             status = container.status
 
-            if container.image.tags: image_tag = container.image.tags[0]
-            else: image_tag = container.image.short_id
+            image_tag = await asyncio.to_thread(self._image_tag, container)
 
             escaped_name = self._escape_html(container_name)
             escaped_image = self._escape_html(image_tag)
@@ -496,9 +1000,10 @@ class DockerBot:
 
             reply_markup = InlineKeyboardMarkup(keyboard)
             await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='HTML', disable_web_page_preview=True)
-        except docker.errors.NotFound:
+        except docker_errors.NotFound:
              await query.edit_message_text(f"❌ Ошибка: Контейнер с именем <code>{self._escape_html(container_name)}</code> не найден.", parse_mode='HTML', disable_web_page_preview=True)
         except Exception as e:
+            self._on_docker_error(e)
             await query.edit_message_text(f"❌ Ошибка при получении информации о контейнере: {self._escape_html(e)}", parse_mode='HTML', disable_web_page_preview=True)
 
 
@@ -509,36 +1014,34 @@ class DockerBot:
 
         data = query.data
 
-        if data == "action_restart_all":
-            await query.edit_message_text(
-                "⏳ Запущена процедура перезапуска ВСЕХ контейнеров...",
-                parse_mode='HTML'
-            )
-
-            success = await self.restart_all_containers()
-            msg = "✅ Все контейнеры успешно перезапущены." if success else "❌ Ошибка при перезапуске ВСЕХ контейнеров."
-
-            await query.edit_message_text(msg, parse_mode='HTML')
-            await asyncio.sleep(5)
-            return await self.show_containers(query)
-
-        # остановка всех контейнеров
-        if query.data == "action_stop_all":
-            await query.edit_message_text("⏳ Останавливаю ВСЕ контейнеры...", parse_mode='HTML')
-            success = await self.stop_all_containers()
-            msg = "⛔ Все контейнеры остановлены." if success else "❌ Ошибка при остановке контейнеров."
-            await query.edit_message_text(msg, parse_mode='HTML')
-            await asyncio.sleep(5)
-            return await self.show_containers(query)
-
-        # запуск всех контейнеров
-        if query.data == "action_start_all":
-            await query.edit_message_text("⏳ Запускаю ВСЕ контейнеры...", parse_mode='HTML')
-            success = await self.start_all_containers()
-            msg = "▶️ Все контейнеры запущены." if success else "❌ Ошибка при запуске контейнеров."
-            await query.edit_message_text(msg, parse_mode='HTML')
-            await asyncio.sleep(5)
-            return await self.show_containers(query)
+        # Операции над всеми контейнерами — долгие, выполняются фоновыми задачами
+        bulk_actions = {
+            "action_restart_all": (
+                "Перезапуск всех контейнеров", self.restart_all_containers,
+                "✅ Все контейнеры успешно перезапущены.", "❌ Ошибка при перезапуске ВСЕХ контейнеров."
+            ),
+            "action_stop_all": (
+                "Остановка всех контейнеров", self.stop_all_containers,
+                "⛔ Все контейнеры остановлены.", "❌ Ошибка при остановке контейнеров."
+            ),
+            "action_start_all": (
+                "Запуск всех контейнеров", self.start_all_containers,
+                "▶️ Все контейнеры запущены.", "❌ Ошибка при запуске контейнеров."
+            ),
+        }
+        if data in bulk_actions:
+            title, operation, ok_msg, fail_msg = bulk_actions[data]
+
+            async def job(task, report):
+                success = await operation(progress=task.set_status)
+                return ok_msg if success else fail_msg
+
+            result_markup = InlineKeyboardMarkup([
+                [InlineKeyboardButton("📋 Список контейнеров", callback_data="list")],
+                [InlineKeyboardButton("🔙 Назад", callback_data="back")],
+            ])
+            await self.start_background_task(query, title, job, result_markup)
+            return
 
 
         # Разбиваем на максимум 2 части: action_<остальное>
@@ -615,57 +1118,140 @@ class DockerBot:
 
 
     async def scheduled_encrypt_and_send(self, bot):
-        """Автоматическая отправка архива по расписанию"""
+        """Автоматическая отправка архива по расписанию.
+
+        Архив шифруется один раз, а поток раздаётся всем получателям из BACKUP_DESTINATIONS:
+        во временный файл для Telegram и/или напрямую в S3 (multipart upload).
+        """
         if not self.enc_password:
             logging.error("❌ Невозможно отправить архив: пароль шифрования не задан.")
             return
 
+        send_telegram = "telegram" in self.backup_destinations
+        send_s3 = "s3" in self.backup_destinations
+
         folder_display_name = self._escape_html(os.path.basename(self.folder_to_archive))
         chat_id = int(os.getenv("ARCHIVE_CHAT_ID", "0"))
         thread_id_str = os.getenv("ARCHIVE_MESSAGE_THREAD_ID", "").strip()
         message_thread_id = int(thread_id_str) if thread_id_str.isdigit() else None
 
-        if chat_id == 0:
+        if chat_id == 0 and send_telegram:
             logging.error("❌ ARCHIVE_CHAT_ID не задан в .env — автоматическая отправка невозможна.")
             return
 
+        encrypted_filepath = None
+        encrypted_file = None
+        s3_client = None
+        upload = None
+        # Ручной бэкап, запущенный в ту же минуту, дождётся окончания ночного (и наоборот)
+        await self.backup_lock.acquire()
         try:
             server_names_env = os.getenv("server_names_env", "backup")
             timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
             output_filename = f"{server_names_env}-{timestamp}.zip.enc"
-            encrypted_filepath = os.path.join(os.getcwd(), output_filename)
 
             logging.info(f"⏳ Запуск автоматической архивации папки {self.folder_to_archive}...")
-            encrypted_filepath, iterations = await self.create_archive_and_encrypt(
-                self.folder_to_archive,
-                encrypted_filepath
-            )
-
-            caption = f"🌙 <b>Автоматический ночной бэкап</b>\n📁 Папка: <code>{folder_display_name}</code>"
-            await bot.send_document(
-                chat_id=chat_id,
-                message_thread_id=message_thread_id,
-                document=encrypted_filepath,
-                caption=caption,
-                parse_mode='HTML'
+            scan = await self.scan_backup_folder(self.folder_to_archive)
+
+            sinks = []
+            errors = []
+            if send_telegram:
+                # Для Telegram нужен готовый файл — пишем в уникальный временный файл, не в рабочий каталог
+                fd, encrypted_filepath = tempfile.mkstemp(suffix=".zip.enc")
+                encrypted_file = os.fdopen(fd, 'wb')
+                sinks.append(encrypted_file)
+            if send_s3:
+                s3_key = f"{self.s3_prefix}{output_filename}"
+                try:
+                    s3_client = self._make_s3_client()
+                    upload = await S3MultipartUpload(
+                        s3_client, s3_key, asyncio.get_running_loop(),
+                        part_size=self.s3_part_size_mb * 1024 * 1024,
+                        concurrency=self.s3_concurrency,
+                        retries=self.s3_part_retries,
+                    ).start()
+                    sinks.append(upload)
+                except Exception as e:
+                    # Недоступность S3 не должна лишать нас бэкапа в Telegram
+                    logging.error(f"❌ Не удалось начать загрузку в S3: {e}")
+                    errors.append(f"S3: {e}")
+                    upload = None
+            if not sinks:
+                raise Exception("; ".join(errors) or "BACKUP_DESTINATIONS: не задано ни одного получателя (telegram, s3).")
+
+            tee = _TeeWriter(sinks)
+            await self.encrypt_folder_to(self.folder_to_archive, tee, scan=scan)
+
+            caption = (
+                f"🌙 <b>Автоматический ночной бэкап</b>\n📁 Папка: <code>{folder_display_name}</code>\n"
+                f"📦 Файлов: {scan.file_count}, {self._format_size(scan.total_bytes)}"
             )
-            logging.info("✅ Автоматический архив успешно отправлен.")
 
-        except Exception as e:
-            error_msg = self._escape_html(str(e))
-            logging.error(f"❌ Ошибка при автоматической архивации: {error_msg}")
-            try:
+            if upload:
+                try:
+                    if upload in tee.failed:
+                        raise tee.failed[upload]
+                    size = await upload.complete()
+                    caption += (
+                        f"\n☁️ S3: <code>{self._escape_html(self.s3_bucket + '/' + s3_key)}</code> "
+                        f"({self._format_size(size)})"
+                    )
+                    logging.info(f"✅ Архив загружен в S3: {self.s3_bucket}/{s3_key}")
+                    upload = None
+                except Exception as e:
+                    errors.append(f"S3: {e}")
+
+            if encrypted_file:
+                encrypted_file.close()
+                if encrypted_file in tee.failed:
+                    errors.append(f"Telegram: {tee.failed[encrypted_file]}")
+                else:
+                    await bot.send_document(
+                        chat_id=chat_id,
+                        message_thread_id=message_thread_id,
+                        document=encrypted_filepath,
+                        filename=output_filename,
+                        caption=caption,
+                        parse_mode='HTML'
+                    )
+                    logging.info("✅ Автоматический архив успешно отправлен.")
+            elif chat_id and not errors:
                 await bot.send_message(
                     chat_id=chat_id,
                     message_thread_id=message_thread_id,
-                    text=f"❌ Ошибка при создании ночного бэкапа:\n<code>{error_msg}</code>",
+                    text=caption,
                     parse_mode='HTML'
                 )
+
+            if errors:
+                raise Exception("; ".join(errors))
+
+        except Exception as e:
+            error_msg = self._escape_html(str(e))
+            logging.error(f"❌ Ошибка при автоматической архивации: {error_msg}")
+            try:
+                if chat_id:
+                    await bot.send_message(
+                        chat_id=chat_id,
+                        message_thread_id=message_thread_id,
+                        text=f"❌ Ошибка при создании ночного бэкапа:\n<code>{error_msg}</code>",
+                        parse_mode='HTML'
+                    )
             except Exception as send_err:
                 logging.error(f"Не удалось отправить уведомление об ошибке: {send_err}")
         finally:
-            if 'encrypted_filepath' in locals() and os.path.exists(encrypted_filepath):
-                os.remove(encrypted_filepath)
+            try:
+                if upload:
+                    # Загрузка не завершена — удаляем уже загруженные части
+                    await upload.abort()
+                if s3_client:
+                    await s3_client.close()
+            finally:
+                if encrypted_file:
+                    encrypted_file.close()
+                if encrypted_filepath and os.path.exists(encrypted_filepath):
+                    os.remove(encrypted_filepath)
+                self.backup_lock.release()
 
 
 
@@ -690,6 +1276,56 @@ class DockerBot:
         scheduler.start()
         logging.info(f"✅ Планировщик запущен: архив будет отправляться ежедневно в {HOUR_TIME_PLAN}:{MINUTE_TIME_PLAN:02d}")
 
+        self.application = application
+        self.docker_supervisor.start()
+        _log_startup_phase("post_init (планировщик запущен, подключение к Docker в фоне)")
+
+    async def _on_docker_state_change(self, connected: bool, client):
+        """Подключение к Docker установлено или потеряно (вызывается DockerSupervisor)."""
+        if self.watchdog:
+            await self.watchdog.stop()
+            self.watchdog = None
+
+        self.docker_client = client if connected else None
+        if not connected:
+            logging.warning("⚠️ Docker недоступен: функции управления контейнерами временно отключены")
+            return
+
+        if not self._docker_connected_once:
+            self._docker_connected_once = True
+            _log_startup_phase("Docker подключён")
+
+        if self.watchdog_enabled and self.application:
+            chat_id_str = os.getenv("WATCHDOG_CHAT_ID") or os.getenv("ARCHIVE_CHAT_ID", "0")
+            thread_id_str = (os.getenv("WATCHDOG_MESSAGE_THREAD_ID") or os.getenv("ARCHIVE_MESSAGE_THREAD_ID", "")).strip()
+            self.watchdog = ContainerWatchdog(
+                client,
+                self.application.bot,
+                chat_id=int(chat_id_str),
+                message_thread_id=int(thread_id_str) if thread_id_str.isdigit() else None,
+                label=self.watchdog_label,
+                backoff_base=float(os.getenv("WATCHDOG_BACKOFF_BASE", "5")),
+                backoff_max=float(os.getenv("WATCHDOG_BACKOFF_MAX", "300")),
+                crashloop_restarts=int(os.getenv("WATCHDOG_CRASHLOOP_RESTARTS", "5")),
+                crashloop_window=float(os.getenv("WATCHDOG_CRASHLOOP_WINDOW", "600")),
+                stable_seconds=float(os.getenv("WATCHDOG_STABLE_SECONDS", "120")),
+                log_lines=int(os.getenv("WATCHDOG_LOG_LINES", "30")),
+            )
+            self.watchdog.start()
+
+    async def _track_first_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Группа после основных обработчиков: время до первого ответа после старта."""
+        if not self._first_update_logged:
+            self._first_update_logged = True
+            _log_startup_phase("первое обновление обработано (time-to-first-response)")
+
+    async def post_shutdown(self, application: Application):
+        """Вызывается при остановке бота"""
+        await self.tasks.shutdown()
+        if self.watchdog:
+            await self.watchdog.stop()
+        await self.docker_supervisor.stop()
+
 
 
 
@@ -700,12 +1336,96 @@ class DockerBot:
             logging.info("❌ BOT_TOKEN не найден. Установите его в файле .env")
             return
 
-        application = Application.builder().token(self.bot_token).post_init(self.post_init).build()
+        application = (
+            Application.builder()
+            .token(self.bot_token)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .concurrent_updates(self.concurrent_updates)
+            .build()
+        )
         application.add_handler(CommandHandler("start", self.start))
         application.add_handler(CallbackQueryHandler(self.button_handler))
+        application.add_handler(TypeHandler(Update, self._track_first_update), group=1)
+        _log_startup_phase("Application собран")
 
         logging.info("Бот запущен...")
-        application.run_polling()
+        if self.webhook_url:
+            asyncio.run(self._run_webhook(application))
+        else:
+            application.run_polling()
+
+    async def _run_webhook(self, application: Application):
+        """
+        Режим webhook: встроенный HTTP-сервер в том же event loop, что планировщик и задачи Docker.
+        Если сервер не запустился (порт занят, неверный адрес или сертификат) или зарегистрировать
+        webhook не удалось — автоматически переходим на polling
+        (запущенный сервер при этом продолжает принимать локальные POST для отладки).
+        """
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+        async def enqueue_update(data: dict):
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+        server = None
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        try:
+            try:
+                ssl_context = None
+                if self.webhook_ssl_cert and self.webhook_ssl_key:
+                    ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+                    ssl_context.load_cert_chain(self.webhook_ssl_cert, self.webhook_ssl_key)
+
+                server = WebhookServer(
+                    enqueue_update,
+                    host=self.webhook_listen,
+                    port=self.webhook_port,
+                    path=self.webhook_path,
+                    secret_token=self.webhook_secret,
+                    ssl_context=ssl_context,
+                )
+                await server.start()
+            except Exception as e:
+                logging.error(f"❌ Не удалось запустить webhook-сервер ({e}) — переключаюсь на polling")
+                server = None
+                await application.updater.start_polling()
+            else:
+                try:
+                    certificate = open(self.webhook_ssl_cert, 'rb') if ssl_context else None
+                    try:
+                        await application.bot.set_webhook(
+                            url=self.webhook_url + server.path,
+                            secret_token=self.webhook_secret,
+                            certificate=certificate,
+                            allowed_updates=Update.ALL_TYPES,
+                        )
+                    finally:
+                        if certificate:
+                            certificate.close()
+                    logging.info(f"✅ Webhook зарегистрирован: {self.webhook_url}{server.path}")
+                except Exception as e:
+                    logging.error(f"❌ Не удалось зарегистрировать webhook ({e}) — переключаюсь на polling")
+                    await application.updater.start_polling()
+
+            await stop_event.wait()
+        finally:
+            if application.updater.running:
+                await application.updater.stop()
+            if server:
+                await server.stop()
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+            await application.shutdown()
 
 
 if __name__ == "__main__":
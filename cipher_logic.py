@@ -5,8 +5,304 @@ from Crypto.Random import get_random_bytes
 import random
 import struct
 import hashlib
+import json
+import logging
+import os
+import platform
+import time
 from typing import Optional
 
+# Argon2id — опциональная зависимость (argon2-cffi)
+try:
+    from argon2.low_level import hash_secret_raw, Type as Argon2Type
+except ImportError:
+    hash_secret_raw = None
+    Argon2Type = None
+
+# ================== KDF (функции выработки ключа) ==================
+
+# Формат нового пакета:
+# MAGIC (4) + kdf_id (1) + длина параметров (1) + параметры + salt (16) + nonce (16) + ciphertext + tag (16)
+# Заголовок (MAGIC..параметры) аутентифицируется GCM как associated data.
+KDF_MAGIC = b"AGK1"
+
+# Верхняя граница памяти для параметров из заголовка (защита от "раздутых" заголовков)
+MAX_KDF_MEMORY = 1024 * 1024 * 1024
+
+
+class PBKDF2SHA256KDF:
+    """PBKDF2-HMAC-SHA256 (hashlib, без ограничений по памяти)."""
+    kdf_id = 1
+    name = "pbkdf2_sha256"
+    # Нижняя граница по рекомендациям OWASP
+    min_iterations = 600000
+
+    def __init__(self, iterations: int = 600000):
+        self.iterations = iterations
+
+    @property
+    def cost(self) -> int:
+        return self.iterations
+
+    def derive(self, secret: bytes, salt: bytes, dk_len: int = 32) -> bytes:
+        return hashlib.pbkdf2_hmac('sha256', secret, salt, self.iterations, dk_len)
+
+    def pack_params(self) -> bytes:
+        return struct.pack('>I', self.iterations)
+
+    @classmethod
+    def unpack_params(cls, data: bytes) -> "PBKDF2SHA256KDF":
+        if len(data) != 4:
+            raise ValueError("Неверные параметры PBKDF2")
+        (iterations,) = struct.unpack('>I', data)
+        if iterations < 1:
+            raise ValueError("Неверные параметры PBKDF2")
+        return cls(iterations)
+
+    def to_dict(self) -> dict:
+        return {"iterations": self.iterations}
+
+    @classmethod
+    def calibrate(cls, target_seconds: float, max_memory: int) -> "PBKDF2SHA256KDF":
+        probe = cls(100000)
+        elapsed = _measure(probe)
+        iterations = int(probe.iterations * target_seconds / elapsed)
+        return cls(max(cls.min_iterations, iterations))
+
+
+class ScryptKDF:
+    """scrypt (hashlib). Память: 128 * r * n байт."""
+    kdf_id = 2
+    name = "scrypt"
+    # Рекомендуемый минимум (32 МБ при r=8); ниже — только если этого требует бюджет памяти
+    min_log_n = 15
+    hard_min_log_n = 10
+
+    def __init__(self, log_n: int = 16, r: int = 8, p: int = 1):
+        self.log_n = log_n
+        self.r = r
+        self.p = p
+
+    @property
+    def cost(self) -> int:
+        return 1 << self.log_n
+
+    @property
+    def memory(self) -> int:
+        return 128 * self.r * (1 << self.log_n)
+
+    def derive(self, secret: bytes, salt: bytes, dk_len: int = 32) -> bytes:
+        n = 1 << self.log_n
+        # Запас по памяти для OpenSSL: 128 * r * (n + p + 2) + 1 МБ
+        maxmem = 128 * self.r * (n + self.p + 2) + 1024 * 1024
+        return hashlib.scrypt(secret, salt=salt, n=n, r=self.r, p=self.p, maxmem=maxmem, dklen=dk_len)
+
+    def pack_params(self) -> bytes:
+        return struct.pack('>BBB', self.log_n, self.r, self.p)
+
+    @classmethod
+    def unpack_params(cls, data: bytes) -> "ScryptKDF":
+        if len(data) != 3:
+            raise ValueError("Неверные параметры scrypt")
+        log_n, r, p = struct.unpack('>BBB', data)
+        kdf = cls(log_n, r, p)
+        if not (1 <= log_n <= 30 and r >= 1 and p >= 1) or kdf.memory > MAX_KDF_MEMORY:
+            raise ValueError("Неверные параметры scrypt")
+        return kdf
+
+    def to_dict(self) -> dict:
+        return {"log_n": self.log_n, "r": self.r, "p": self.p}
+
+    @classmethod
+    def calibrate(cls, target_seconds: float, max_memory: int) -> "ScryptKDF":
+        r = 8
+        if 128 * r * (1 << cls.hard_min_log_n) > max_memory:
+            raise ValueError(f"Бюджет памяти KDF слишком мал для scrypt: {max_memory // (1024 * 1024)} МБ")
+        # Максимальный n, укладывающийся в бюджет памяти
+        log_n = cls.hard_min_log_n
+        while 128 * r * (1 << (log_n + 1)) <= max_memory:
+            log_n += 1
+        if log_n < cls.min_log_n:
+            logging.warning(
+                f"Бюджет памяти KDF ниже рекомендуемого для scrypt "
+                f"({128 * r * (1 << cls.min_log_n) // (1024 * 1024)} МБ): используется log_n={log_n}"
+            )
+
+        kdf = cls(log_n, r, 1)
+        elapsed = _measure(kdf)
+        # Слишком медленно — уменьшаем n (но не ниже минимума)
+        while elapsed > target_seconds and kdf.log_n > min(cls.min_log_n, log_n):
+            kdf = cls(kdf.log_n - 1, r, 1)
+            elapsed = _measure(kdf)
+        # Запас по времени — увеличиваем p (время растёт линейно, память — нет)
+        kdf.p = max(1, min(255, int(target_seconds / elapsed)))
+        return kdf
+
+
+class Argon2idKDF:
+    """Argon2id (argon2-cffi)."""
+    kdf_id = 3
+    name = "argon2id"
+    min_memory_kib = 19 * 1024
+    min_time_cost = 2
+
+    def __init__(self, time_cost: int = 3, memory_kib: int = 64 * 1024, parallelism: int = 1):
+        self.time_cost = time_cost
+        self.memory_kib = memory_kib
+        self.parallelism = parallelism
+
+    @property
+    def cost(self) -> int:
+        return self.time_cost
+
+    @property
+    def memory(self) -> int:
+        return self.memory_kib * 1024
+
+    @staticmethod
+    def available() -> bool:
+        return hash_secret_raw is not None
+
+    def derive(self, secret: bytes, salt: bytes, dk_len: int = 32) -> bytes:
+        if not self.available():
+            raise RuntimeError("Для Argon2id требуется пакет argon2-cffi.")
+        return hash_secret_raw(
+            secret, salt,
+            time_cost=self.time_cost,
+            memory_cost=self.memory_kib,
+            parallelism=self.parallelism,
+            hash_len=dk_len,
+            type=Argon2Type.ID,
+        )
+
+    def pack_params(self) -> bytes:
+        return struct.pack('>IIB', self.time_cost, self.memory_kib, self.parallelism)
+
+    @classmethod
+    def unpack_params(cls, data: bytes) -> "Argon2idKDF":
+        if len(data) != 9:
+            raise ValueError("Неверные параметры Argon2id")
+        time_cost, memory_kib, parallelism = struct.unpack('>IIB', data)
+        kdf = cls(time_cost, memory_kib, parallelism)
+        if time_cost < 1 or parallelism < 1 or memory_kib < 8 * parallelism or kdf.memory > MAX_KDF_MEMORY:
+            raise ValueError("Неверные параметры Argon2id")
+        return kdf
+
+    def to_dict(self) -> dict:
+        return {"time_cost": self.time_cost, "memory_kib": self.memory_kib, "parallelism": self.parallelism}
+
+    @classmethod
+    def calibrate(cls, target_seconds: float, max_memory: int) -> "Argon2idKDF":
+        parallelism = max(1, min(4, os.cpu_count() or 1))
+        memory_kib = max_memory // 1024
+        if memory_kib < 8 * parallelism:
+            raise ValueError(f"Бюджет памяти KDF слишком мал для Argon2id: {memory_kib} КиБ")
+        if memory_kib < cls.min_memory_kib:
+            logging.warning(
+                f"Бюджет памяти KDF ниже рекомендуемого для Argon2id "
+                f"({cls.min_memory_kib // 1024} МБ): используется {memory_kib} КиБ"
+            )
+
+        kdf = cls(1, memory_kib, parallelism)
+        elapsed = _measure(kdf)
+        # Слишком медленно даже за один проход — уменьшаем память (но не ниже минимума)
+        while elapsed * cls.min_time_cost > target_seconds and kdf.memory_kib // 2 >= min(cls.min_memory_kib, memory_kib):
+            kdf = cls(1, kdf.memory_kib // 2, parallelism)
+            elapsed = _measure(kdf)
+        kdf.time_cost = max(cls.min_time_cost, int(target_seconds / elapsed))
+        return kdf
+
+
+KDF_ALGORITHMS = {kdf.name: kdf for kdf in (PBKDF2SHA256KDF, ScryptKDF, Argon2idKDF)}
+_KDF_BY_ID = {kdf.kdf_id: kdf for kdf in KDF_ALGORITHMS.values()}
+
+# Кэш калибровки в памяти процесса (ключ -> экземпляр KDF)
+_CALIBRATION_CACHE = {}
+
+
+def _measure(kdf) -> float:
+    """Время одной выработки ключа с данными параметрами (в секундах)."""
+    start = time.perf_counter()
+    kdf.derive(b"calibration", b"\x00" * 16)
+    return max(time.perf_counter() - start, 1e-6)
+
+
+def _host_fingerprint() -> str:
+    """Идентификатор железа хоста (не контейнера): модель CPU, число ядер, архитектура."""
+    cpu_model = platform.processor()
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu_model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{platform.machine()}|{cpu_model}|{os.cpu_count()}"
+
+
+def calibrate_kdf(algorithm: str, target_seconds: float = 1.0, max_memory_mb: int = 64,
+                  cache_path: Optional[str] = None):
+    """
+    Подбирает параметры KDF под текущий хост: целевое время выработки ключа
+    и бюджет памяти. Результат кэшируется в памяти и (если задан cache_path)
+    в JSON-файле, поэтому замер выполняется один раз на хост.
+    """
+    if algorithm not in KDF_ALGORITHMS:
+        raise ValueError(f"Неизвестный алгоритм KDF: {algorithm}")
+    kdf_cls = KDF_ALGORITHMS[algorithm]
+    if kdf_cls is Argon2idKDF and not Argon2idKDF.available():
+        raise RuntimeError("Для Argon2id требуется пакет argon2-cffi.")
+
+    key = f"{algorithm}|{target_seconds}|{max_memory_mb}|{_host_fingerprint()}"
+    if key in _CALIBRATION_CACHE:
+        return _CALIBRATION_CACHE[key]
+
+    file_cache = {}
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, encoding='utf-8') as f:
+                file_cache = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Не удалось прочитать кэш калибровки KDF {cache_path}: {e}")
+            file_cache = {}
+
+    if key in file_cache:
+        kdf = kdf_cls(**file_cache[key])
+    else:
+        start = time.perf_counter()
+        kdf = kdf_cls.calibrate(target_seconds, max_memory_mb * 1024 * 1024)
+        logging.info(f"Калибровка KDF {algorithm}: {kdf.to_dict()} за {time.perf_counter() - start:.1f} сек")
+        if cache_path:
+            file_cache[key] = kdf.to_dict()
+            try:
+                with open(cache_path, 'w', encoding='utf-8') as f:
+                    json.dump(file_cache, f, indent=2)
+            except OSError as e:
+                logging.warning(f"Не удалось сохранить кэш калибровки KDF {cache_path}: {e}")
+
+    _CALIBRATION_CACHE[key] = kdf
+    return kdf
+
+
+def pack_kdf_header(kdf) -> bytes:
+    params = kdf.pack_params()
+    return KDF_MAGIC + bytes([kdf.kdf_id, len(params)]) + params
+
+
+def unpack_kdf_header(packet: bytes):
+    """Разбирает заголовок KDF. Возвращает (kdf, длина заголовка)."""
+    if not packet.startswith(KDF_MAGIC) or len(packet) < len(KDF_MAGIC) + 2:
+        raise ValueError("Нет заголовка KDF")
+    kdf_id = packet[len(KDF_MAGIC)]
+    params_len = packet[len(KDF_MAGIC) + 1]
+    header_len = len(KDF_MAGIC) + 2 + params_len
+    if kdf_id not in _KDF_BY_ID or len(packet) < header_len:
+        raise ValueError("Неизвестный или повреждённый заголовок KDF")
+    kdf = _KDF_BY_ID[kdf_id].unpack_params(packet[len(KDF_MAGIC) + 2:header_len])
+    return kdf, header_len
+
+
 # ================== Класс шифрования ==================
 
 def calculate_iterations_from_password(password: str, iterations_password: str) -> int:
@@ -29,23 +325,40 @@ def calculate_iterations_from_password(password: str, iterations_password: str)
     return iterations
 
 class AESGCMCipher:
-    def __init__(self, password: str, iterations_password: str = ""):
+    def __init__(self, password: str, iterations_password: str = "", kdf=None):
+        """
+        kdf — экземпляр PBKDF2SHA256KDF / ScryptKDF / Argon2idKDF. Если задан, шифрование
+        идёт в новом формате (параметры KDF в заголовке), иначе — в старом (PBKDF2-SHA1).
+        Расшифрование понимает оба формата.
+        """
         self.password = password.encode('utf-8')
         self.iterations_password = iterations_password.encode('utf-8')
+        self.kdf = kdf
+
+    def _kdf_secret(self) -> bytes:
+        """Секрет для KDF нового формата: пароль и (если задан) пароль итераций."""
+        if self.iterations_password:
+            return self.password + b"\x00" + self.iterations_password
+        return self.password
 
     def _get_encryption_key(self, salt: bytes, iterations: int) -> bytes:
         """Получает ключ из пароля, соли и итераций."""
         # dkLen=32 для AES-256
         return PBKDF2(self.password, salt, dkLen=32, count=iterations)
 
-    def encrypt(self, data: bytes, iterations: Optional[int] = None) -> (bytes, int):
+    def _new_gcm(self, iterations: Optional[int] = None):
         """
-        Шифрует данные. Если итерации не заданы, использует случайное число
-        или вычисляет его из пароля и пароля для итераций, если он задан.
-        
-        Возвращает: (зашифрованный пакет, использованное количество итераций)
+        Готовит шифрование: выбирает итерации/KDF, вырабатывает ключ.
+        Возвращает (префикс пакета до ciphertext, объект GCM, итерации или стоимость KDF).
         """
         salt = get_random_bytes(16)
+
+        if self.kdf is not None:
+            header = pack_kdf_header(self.kdf)
+            key = self.kdf.derive(self._kdf_secret(), salt)
+            cipher = AES.new(key, AES.MODE_GCM)
+            cipher.update(header)
+            return header + salt + cipher.nonce, cipher, self.kdf.cost
         
         # Определяем количество итераций для шифрования
         actual_iterations = 0
@@ -69,12 +382,31 @@ class AESGCMCipher:
         key = self._get_encryption_key(salt, actual_iterations)
 
         cipher = AES.new(key, AES.MODE_GCM)
-        ciphertext, tag = cipher.encrypt_and_digest(data)
+        # salt (16) + nonce (16), далее ciphertext + tag (16)
+        return salt + cipher.nonce, cipher, actual_iterations
+
+    def encrypt(self, data: bytes, iterations: Optional[int] = None) -> (bytes, int):
+        """
+        Шифрует данные. Если итерации не заданы, использует случайное число
+        или вычисляет его из пароля и пароля для итераций, если он задан.
         
-        # salt (16) + nonce (16) + ciphertext + tag (16)
-        encrypted_packet = salt + cipher.nonce + ciphertext + tag
+        Возвращает: (зашифрованный пакет, использованное количество итераций)
+        Если задан self.kdf — вместо итераций возвращается его стоимость (kdf.cost).
+        """
+        prefix, cipher, actual_iterations = self._new_gcm(iterations)
+        ciphertext, tag = cipher.encrypt_and_digest(data)
+        encrypted_packet = prefix + ciphertext + tag
         return encrypted_packet, actual_iterations
 
+    def encrypt_stream(self, sink, iterations: Optional[int] = None) -> "GCMStreamWriter":
+        """
+        Потоковое шифрование: возвращает файлоподобный объект, который шифрует всё,
+        что в него пишут, и передаёт результат в sink (любой объект с write()).
+        Итоговый поток байт совпадает с пакетом encrypt() — формат тот же.
+        """
+        prefix, cipher, actual_iterations = self._new_gcm(iterations)
+        return GCMStreamWriter(cipher, sink, prefix, actual_iterations)
+
     def decrypt(self, packet: bytes, preferred_iterations: int) -> bytes:
         """
         Расшифровывает данные, сначала пытаясь использовать preferred_iterations,
@@ -82,7 +414,22 @@ class AESGCMCipher:
         
         preferred_iterations - это значение, которое было в поле 'Итерации для расшифровки'
         (по умолчанию 100000), предназначенное для быстрого теста.
+        Пакеты нового формата (с заголовком KDF) расшифровываются по параметрам из заголовка.
         """
+        if packet.startswith(KDF_MAGIC):
+            try:
+                header = unpack_kdf_header(packet)
+            except ValueError:
+                # Совпадение MAGIC оказалось случайным (соль старого формата) — пробуем старый формат
+                header = None
+            if header is not None:
+                # Заголовок разобран — это новый формат; неверный пароль не повод тратить
+                # ещё несколько секунд на PBKDF2-SHA1 старого формата
+                try:
+                    return self._decrypt_with_header(packet, header)
+                except ValueError as e:
+                    raise ValueError("Ошибка расшифрования: повреждённые данные или неверный пароль") from e
+
         try:
             salt = packet[:16]
             nonce = packet[16:32]
@@ -115,4 +462,83 @@ class AESGCMCipher:
                 return plaintext
             except ValueError as e:
                 # Ни одна попытка не удалась
-                raise ValueError("Ошибка расшифрования: повреждённые данные или неверный пароль") from e
\ No newline at end of file
+                raise ValueError("Ошибка расшифрования: повреждённые данные или неверный пароль") from e
+
+    def _decrypt_with_header(self, packet: bytes, header=None) -> bytes:
+        kdf, header_len = header or unpack_kdf_header(packet)
+        header = packet[:header_len]
+        body = packet[header_len:]
+        if len(body) < 48:
+            raise ValueError("Пакет слишком короткий")
+        salt = body[:16]
+        nonce = body[16:32]
+        ciphertext = body[32:-16]
+        tag = body[-16:]
+
+        key = kdf.derive(self._kdf_secret(), salt)
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(header)
+        return cipher.decrypt_and_verify(ciphertext, tag)
+
+
+class GCMStreamWriter:
+    """Файлоподобный объект для AESGCMCipher.encrypt_stream (только запись, без seek/tell)."""
+
+    def __init__(self, cipher, sink, prefix: bytes, iterations: int):
+        self._cipher = cipher
+        self._sink = sink
+        self.iterations = iterations
+        self.closed = False
+        self._sink.write(prefix)
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("Запись в закрытый поток шифрования")
+        if data:
+            self._sink.write(self._cipher.encrypt(bytes(data)))
+        return len(data)
+
+    def flush(self):
+        if hasattr(self._sink, 'flush'):
+            self._sink.flush()
+
+    def close(self):
+        """Дописывает тег GCM. Sink не закрывается."""
+        if self.closed:
+            return
+        self.closed = True
+        self._sink.write(self._cipher.digest())
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # При ошибке тег не пишем: неполный пакет не пройдёт проверку при расшифровке
+        if exc_type is None:
+            self.close()
+        else:
+            self.closed = True
+
+
+if __name__ == "__main__":
+    # Расшифровка бэкапа (оба формата): python cipher_logic.py <файл.zip.enc> <файл.zip>
+    # Пароли берутся из ENCRYPTION_PASSWORD / ITERATIONS_PASSWORD или запрашиваются.
+    import sys
+    import getpass
+
+    if len(sys.argv) != 3:
+        print("Использование: python cipher_logic.py <входной .enc> <выходной файл>")
+        sys.exit(2)
+
+    password = os.getenv("ENCRYPTION_PASSWORD") or getpass.getpass("Пароль шифрования: ")
+    iterations_password = os.getenv("ITERATIONS_PASSWORD")
+    if iterations_password is None:
+        iterations_password = getpass.getpass("Пароль итераций (Enter — пусто): ")
+
+    with open(sys.argv[1], 'rb') as f:
+        packet = f.read()
+    plaintext = AESGCMCipher(password, iterations_password).decrypt(packet, 100000)
+    with open(sys.argv[2], 'wb') as f:
+        f.write(plaintext)
+    print(f"Готово: {sys.argv[2]}")
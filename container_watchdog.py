@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextlib
+import html
+import logging
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+
+# ================== Watchdog контейнеров ==================
+# Подписывается на события Docker (die / health_status / oom) вместо опроса,
+# перезапускает помеченные меткой контейнеры с экспоненциальной задержкой,
+# распознаёт crash loop и шлёт в админ-чат одно сообщение на инцидент (дальше оно редактируется).
+
+class _ContainerState:
+    def __init__(self):
+        self.dies = deque()          # время последних падений (для crash loop)
+        self.failed_at = 0.0         # последнее событие сбоя (die / oom / unhealthy)
+        self.stopped_at = 0.0        # событие "stop" (docker stop / остановка через бота)
+        # Окна вызовов stop/restart (время Docker, нс): (начало, конец или None, пока идёт).
+        # События внутри окна вызваны самим вызовом; всё, что после, — новый сбой
+        self.restart_window = (None, None)   # перезапуск самим watchdog
+        self.manual_window = (None, None)    # stop/restart через бота
+        self.reasons = []
+        self.failure = asyncio.Event()
+        self.task = None
+
+
+class _Incident:
+    def __init__(self, name: str, reasons: list, logs: str):
+        self.name = name
+        self.started = time.monotonic()
+        self.reasons = list(reasons)
+        self.logs = logs
+        self.restarts = 0
+        self.crash_loop = False
+        self.message_id = None
+        self.last_text = None
+
+
+class ContainerWatchdog:
+    def __init__(self, docker_client, bot, chat_id: int, message_thread_id: Optional[int] = None,
+                 label: str = "docker-bot.watchdog=true",
+                 backoff_base: float = 5, backoff_max: float = 300,
+                 crashloop_restarts: int = 5, crashloop_window: float = 600,
+                 stable_seconds: float = 120, log_lines: int = 30, grace_seconds: float = 3):
+        self.docker_client = docker_client
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_thread_id = message_thread_id
+        self.label = label
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.crashloop_restarts = crashloop_restarts
+        self.crashloop_window = crashloop_window
+        self.stable_seconds = stable_seconds
+        self.log_lines = log_lines
+        self.grace_seconds = grace_seconds
+
+        self._states = {}
+        self._incidents = {}
+        self._loop = None
+        self._queue = None
+        self._consumer = None
+        self._thread = None
+        self._stream = None
+        self._stopping = threading.Event()
+
+    # --- Запуск / остановка ---
+
+    def start(self):
+        """Запускает поток чтения событий Docker и обработчик в текущем event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._stopping.clear()
+        self._consumer = asyncio.create_task(self._consume())
+        self._thread = threading.Thread(target=self._read_events, name="docker-events", daemon=True)
+        self._thread.start()
+        logging.info(f"🐶 Watchdog запущен: контейнеры с меткой {self.label}")
+
+    async def stop(self):
+        self._stopping.set()
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except Exception:
+                pass
+        tasks = [self._consumer] + [s.task for s in self._states.values() if s.task]
+        for task in tasks:
+            if task:
+                task.cancel()
+        await asyncio.gather(*[t for t in tasks if t], return_exceptions=True)
+
+    @contextlib.contextmanager
+    def manual_action(self, container_name: str, stop: bool = False):
+        """
+        Оборачивает stop/restart контейнера через бота: события внутри вызова ожидаемы и пропускаются.
+        После успешного stop контейнер считается остановленным вручную (без автоперезапуска),
+        после restart — снова под наблюдением: падение сразу после него — новый сбой.
+        """
+        state = self._state(container_name)
+        start = time.time_ns()
+        state.manual_window = (start, None)
+        try:
+            yield
+            if stop:
+                state.stopped_at = time.monotonic()
+                # Будим обработку текущего инцидента, чтобы она не перезапустила контейнер
+                state.failure.set()
+        finally:
+            state.manual_window = (start, time.time_ns())
+
+    # --- Поток событий Docker ---
+
+    def _read_events(self):
+        delay = 1
+        filters = {
+            'type': 'container',
+            'event': ['die', 'oom', 'health_status', 'stop'],
+            'label': [self.label],
+        }
+        while not self._stopping.is_set():
+            try:
+                self._stream = self.docker_client.events(decode=True, filters=filters)
+                delay = 1
+                for event in self._stream:
+                    self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+            except Exception as e:
+                if self._stopping.is_set():
+                    break
+                logging.warning(f"Watchdog: поток событий Docker прерван: {e}. Переподключение через {delay} сек")
+            if self._stopping.wait(delay):
+                break
+            delay = min(delay * 2, 60)
+
+    async def _consume(self):
+        while True:
+            event = await self._queue.get()
+            try:
+                self._on_event(event)
+            except Exception as e:
+                logging.error(f"Watchdog: ошибка обработки события {event}: {e}")
+
+    def _state(self, name: str) -> _ContainerState:
+        if name not in self._states:
+            self._states[name] = _ContainerState()
+        return self._states[name]
+
+    def _on_event(self, event: dict):
+        attributes = event.get('Actor', {}).get('Attributes', {})
+        name = attributes.get('name')
+        action = event.get('Action') or event.get('status') or ""
+        if not name:
+            return
+
+        state = self._state(name)
+        now = time.monotonic()
+
+        # События от намеренных stop/restart (через бота или сам watchdog) пропускаем
+        if self._in_window(state.restart_window, event) or self._in_window(state.manual_window, event):
+            return
+
+        if action == 'stop':
+            state.stopped_at = now
+            return
+
+        if action == 'die':
+            state.dies.append(now)
+            reason = f"💥 Завершился (код {attributes.get('exitCode', '?')})"
+        elif action == 'oom':
+            reason = "🧠 Нехватка памяти (OOM)"
+        elif action.startswith('health_status'):
+            if action.split(':', 1)[-1].strip() != 'unhealthy':
+                return
+            reason = "🩺 Healthcheck: unhealthy"
+        else:
+            return
+
+        logging.info(f"Watchdog: {name}: {action}")
+        state.failed_at = now
+        state.reasons.append(reason)
+        if state.task is None or state.task.done():
+            state.task = asyncio.create_task(self._supervise(name))
+        else:
+            state.failure.set()
+
+    # --- Обработка инцидента ---
+
+    def _inspect(self, name: str):
+        """(status, health) контейнера или None, если его больше нет."""
+        from docker import errors as docker_errors
+        try:
+            container = self.docker_client.containers.get(name)
+        except docker_errors.NotFound:
+            return None
+        health = container.attrs.get('State', {}).get('Health', {}).get('Status')
+        return container.status, health
+
+    @staticmethod
+    def _in_window(window: tuple, event: dict) -> bool:
+        """
+        Событие вызвано намеренным stop/restart (stop/die внутри вызова Docker)?
+        Сравниваем время события с окном вызова: падение сразу после
+        перезапуска — это новый сбой, и оно должно учитываться для crash loop.
+        """
+        start, end = window
+        if start is None:
+            return False
+        event_ns = event.get('timeNano') or int(event.get('time', 0) * 1_000_000_000) or time.time_ns()
+        return start <= event_ns and (end is None or event_ns <= end)
+
+    def _crash_loop(self, state: _ContainerState) -> bool:
+        border = time.monotonic() - self.crashloop_window
+        while state.dies and state.dies[0] < border:
+            state.dies.popleft()
+        return len(state.dies) >= self.crashloop_restarts
+
+    async def _supervise(self, name: str):
+        state = self._state(name)
+        incident = self._incidents.get(name)
+        try:
+            while True:
+                await asyncio.sleep(self.grace_seconds)
+
+                # Остановлен вручную (docker stop или через бота) — не вмешиваемся
+                if state.stopped_at >= state.failed_at:
+                    if incident:
+                        await self._close(incident, "⏹ Остановлен вручную, автоперезапуск не выполняется")
+                    return
+
+                info = await asyncio.to_thread(self._inspect, name)
+                if info is None:
+                    if incident:
+                        await self._close(incident, "🗑 Контейнер удалён")
+                    return
+                status, health = info
+                crash_loop = self._crash_loop(state)
+                failing = crash_loop or status != 'running' or health == 'unhealthy'
+
+                if not failing and incident is None:
+                    # Уже поднят политикой restart или вручную — инцидента нет
+                    state.reasons.clear()
+                    return
+
+                if incident is None:
+                    logs = await asyncio.to_thread(self._tail_logs, name)
+                    incident = _Incident(name, state.reasons, logs)
+                    self._incidents[name] = incident
+                    state.reasons.clear()
+                    await self._notify(incident, "⏳ Обработка...")
+                elif state.reasons:
+                    incident.reasons.extend(state.reasons)
+                    state.reasons.clear()
+
+                state.failure.clear()
+                if crash_loop:
+                    incident.crash_loop = True
+                    await self._notify(
+                        incident,
+                        f"🔁 <b>Crash loop</b>: {len(state.dies)} падений за {int(self.crashloop_window)} сек. "
+                        f"Автоперезапуск приостановлен."
+                    )
+                elif failing:
+                    delay = min(self.backoff_base * (2 ** incident.restarts), self.backoff_max)
+                    await self._notify(incident, f"🔄 Перезапуск #{incident.restarts + 1} через {int(delay)} сек")
+                    try:
+                        await asyncio.wait_for(state.failure.wait(), delay)
+                        # Новый сбой во время ожидания — начинаем цикл заново
+                        continue
+                    except asyncio.TimeoutError:
+                        pass
+                    incident.restarts += 1
+                    ok = await asyncio.to_thread(self._restart, name, state)
+                    await self._notify(
+                        incident,
+                        f"🔄 Перезапуск #{incident.restarts} {'выполнен' if ok else 'не удался'}, "
+                        f"ожидание стабильной работы {int(self.stable_seconds)} сек"
+                    )
+
+                # Ждём новый сбой или стабильную работу в течение stable_seconds
+                try:
+                    await asyncio.wait_for(state.failure.wait(), self.stable_seconds)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+
+                info = await asyncio.to_thread(self._inspect, name)
+                if info and info[0] == 'running' and info[1] != 'unhealthy':
+                    state.dies.clear()
+                    await self._close(incident, f"✅ Восстановлен (перезапусков: {incident.restarts})")
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Watchdog: ошибка обработки инцидента {name}: {e}")
+
+    def _restart(self, name: str, state: _ContainerState) -> bool:
+        # Падение, вызванное нашим же перезапуском, не считаем новым сбоем — но только
+        # события внутри вызова restart(); всё, что случилось после, — новое падение
+        state.restart_window = (time.time_ns(), None)
+        try:
+            self.docker_client.containers.get(name).restart()
+            return True
+        except Exception as e:
+            logging.error(f"Watchdog: не удалось перезапустить {name}: {e}")
+            return False
+        finally:
+            state.restart_window = (state.restart_window[0], time.time_ns())
+
+    def _tail_logs(self, name: str) -> str:
+        try:
+            logs = self.docker_client.containers.get(name).logs(tail=self.log_lines).decode('utf-8', errors='replace')
+        except Exception as e:
+            logs = f"Не удалось получить логи: {e}"
+        return logs[-2500:]
+
+    # --- Уведомления ---
+
+    def _render(self, incident: _Incident, status: str) -> str:
+        reasons = "\n".join(f"• {html.escape(r)}" for r in dict.fromkeys(incident.reasons))
+        text = (
+            f"🚨 <b>Сбой контейнера</b> <code>{html.escape(incident.name)}</code>\n\n"
+            f"{reasons}\n\n"
+            f"{status}\n"
+        )
+        if incident.logs:
+            text += f"\n📝 <b>Последние строки лога:</b>\n<pre>{html.escape(incident.logs)}</pre>"
+        return text
+
+    async def _notify(self, incident: _Incident, status: str):
+        """Первое уведомление по инциденту — новое сообщение, дальше — редактирование того же."""
+        if not self.chat_id:
+            logging.info(f"Watchdog: {incident.name}: {status}")
+            return
+        text = self._render(incident, status)
+        if text == incident.last_text:
+            return
+        incident.last_text = text
+        try:
+            if incident.message_id is None:
+                message = await self.bot.send_message(
+                    chat_id=self.chat_id,
+                    message_thread_id=self.message_thread_id,
+                    text=text,
+                    parse_mode='HTML'
+                )
+                incident.message_id = message.message_id
+            else:
+                await self.bot.edit_message_text(
+                    chat_id=self.chat_id,
+                    message_id=incident.message_id,
+                    text=text,
+                    parse_mode='HTML'
+                )
+        except Exception as e:
+            # "Message is not modified" и сетевые ошибки не должны ломать обработку
+            logging.warning(f"Watchdog: не удалось отправить уведомление: {e}")
+
+    async def _close(self, incident: _Incident, status: str):
+        duration = int(time.monotonic() - incident.started)
+        await self._notify(incident, f"{status}\n⏱ Длительность инцидента: {duration} сек")
+        self._incidents.pop(incident.name, None)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+from typing import Optional
+
+
+# ================== Подключение к Docker ==================
+# Подключается к Docker в фоне и держит подключение: переподключение с экспоненциальной
+# задержкой, периодическая проверка ping и уведомление подписчиков о смене состояния.
+# Бот не ждёт Docker при старте — функции Docker включаются, как только появится сокет.
+
+class DockerSupervisor:
+    def __init__(self, base_url: str = "unix:///var/run/docker.sock", on_change=None,
+                 check_interval: float = 30, backoff_max: float = 30):
+        """
+        on_change(connected: bool, client) — async-функция, вызывается при подключении
+        (client — DockerClient) и при потере подключения (client — None).
+        """
+        self.base_url = base_url
+        self.on_change = on_change
+        self.check_interval = check_interval
+        self.backoff_max = backoff_max
+        self.client = None
+        self._task = None
+        self._wakeup = None
+
+    @property
+    def connected(self) -> bool:
+        return self.client is not None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.client:
+            await asyncio.to_thread(self.client.close)
+            self.client = None
+
+    def check_now(self):
+        """Внеочередная проверка подключения (например, после ошибки вызова Docker)."""
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _socket_path(self) -> Optional[str]:
+        if self.base_url.startswith("unix://"):
+            return self.base_url[len("unix://"):]
+        return None
+
+    def _connect(self):
+        """Блокирующее подключение (выполняется в потоке). Возвращает клиент или бросает исключение."""
+        socket_path = self._socket_path()
+        if socket_path and not os.path.exists(socket_path):
+            raise ConnectionError(f"Docker socket не найден: {socket_path}")
+
+        # docker SDK тянет requests/urllib3 — импортируем только когда он действительно нужен
+        import docker
+        client = docker.DockerClient(base_url=self.base_url)
+        try:
+            client.ping()
+        except Exception:
+            client.close()
+            raise
+        return client
+
+    async def _connect_in_thread(self):
+        connect = asyncio.ensure_future(asyncio.to_thread(self._connect))
+        try:
+            return await asyncio.shield(connect)
+        except asyncio.CancelledError:
+            # Поток подключения не прервать: если он всё же подключится после stop(), закрываем клиент
+            connect.add_done_callback(self._close_abandoned)
+            raise
+
+    @staticmethod
+    def _close_abandoned(future):
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+    def _ping(self) -> bool:
+        try:
+            return bool(self.client.ping())
+        except Exception:
+            return False
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _emit(self, connected: bool):
+        if not self.on_change:
+            return
+        try:
+            await self.on_change(connected, self.client)
+        except Exception as e:
+            logging.error(f"Ошибка обработчика смены состояния Docker: {e}")
+
+    async def _run(self):
+        delay = 1
+        last_error = None
+        while True:
+            if self.client is None:
+                try:
+                    self.client = await self._connect_in_thread()
+                except Exception as e:
+                    # Повторяющуюся ошибку не пишем в лог на каждой попытке
+                    if str(e) != last_error:
+                        logging.info(f"Docker недоступен: {e}. Повтор с задержкой до {int(self.backoff_max)} сек")
+                        last_error = str(e)
+                    await self._sleep(delay)
+                    delay = min(delay * 2, self.backoff_max)
+                    continue
+
+                delay = 1
+                last_error = None
+                logging.info("Docker подключение успешно установлено")
+                await self._emit(True)
+
+            await self._sleep(self.check_interval)
+            if not await asyncio.to_thread(self._ping):
+                logging.warning("Потеряно подключение к Docker, переподключение...")
+                client, self.client = self.client, None
+                await asyncio.to_thread(client.close)
+                await self._emit(False)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import tarfile
+import tempfile
+import time
+from typing import Optional
+
+
+# ================== Сборка логов контейнеров ==================
+# Логи всех (или выбранных) контейнеров скачиваются параллельно и потоком пишутся
+# в tar.gz. Заголовку tar нужен размер файла, поэтому каждый лог сначала сбрасывается
+# во временный файл на диске: в памяти держатся только отдельные куски потока Docker.
+
+def _fetch_logs(container, since: Optional[int]):
+    """Скачивает логи контейнера во временный файл. Возвращает (файл, размер)."""
+    spool = tempfile.TemporaryFile()
+    try:
+        for chunk in container.logs(stream=True, follow=False, since=since, timestamps=True):
+            spool.write(chunk)
+        size = spool.tell()
+        spool.seek(0)
+        return spool, size
+    except Exception:
+        spool.close()
+        raise
+
+
+class _Output:
+    """Выход tar-потока. После прерывания сборки запись отбрасывается: иначе tarfile
+    при сборке мусора попытается дописать хвост gzip в уже закрытый поток."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.aborted = False
+
+    def write(self, data):
+        if not self.aborted:
+            self.fileobj.write(data)
+        return len(data)
+
+
+def _add_member(tar: tarfile.TarFile, name: str, fileobj, size: int):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    tar.addfile(info, fileobj)
+
+
+async def write_log_bundle(docker_client, fileobj, names=None, since: Optional[int] = None,
+                           concurrency: int = 4, progress=None) -> dict:
+    """
+    Пишет tar.gz с логами контейнеров в fileobj (любой объект с write(), например поток шифрования).
+
+    names — имена контейнеров (None или пусто — все), since — unix-время начала логов.
+    До `concurrency` контейнеров скачиваются одновременно, запись в архив — по одному.
+    Возвращает {'containers': число, 'bytes': объём логов, 'errors': {имя: ошибка}}.
+    """
+    containers = await asyncio.to_thread(docker_client.containers.list, all=True)
+    if names:
+        containers = [c for c in containers if c.name in names]
+
+    output = _Output(fileobj)
+    tar = tarfile.open(fileobj=output, mode='w|gz')
+    slots = asyncio.Semaphore(max(1, concurrency))
+    tar_lock = asyncio.Lock()
+    result = {'containers': 0, 'bytes': 0, 'errors': {}}
+    done = 0
+
+    async def collect(container):
+        nonlocal done
+        async with slots:
+            try:
+                spool, size = await asyncio.to_thread(_fetch_logs, container, since)
+            except Exception as e:
+                logging.error(f"Не удалось получить логи {container.name}: {e}")
+                result['errors'][container.name] = str(e)
+                spool = None
+        if spool is not None:
+            try:
+                async with tar_lock:
+                    await asyncio.to_thread(_add_member, tar, f"{container.name}.log", spool, size)
+                result['containers'] += 1
+                result['bytes'] += size
+            finally:
+                spool.close()
+        done += 1
+        if progress:
+            progress(f"📥 Логи: {done}/{len(containers)} контейнеров")
+
+    tasks = [asyncio.create_task(collect(c)) for c in containers]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Ошибка записи в архив (или отмена) — остальные загрузки больше не нужны
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        output.aborted = True
+        raise
+
+    # Сводка: какие контейнеры вошли, за какой период и какие ошибки были
+    summary = [f"Собрано: {time.strftime('%Y-%m-%d %H:%M:%S')}"]
+    summary.append(f"С момента: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(since)) if since else 'всё время'}")
+    summary.extend(f"OK     {c.name}" for c in containers if c.name not in result['errors'])
+    summary.extend(f"ОШИБКА {name}: {error}" for name, error in result['errors'].items())
+    data = ("\n".join(summary) + "\n").encode('utf-8')
+    with tempfile.TemporaryFile() as spool:
+        spool.write(data)
+        spool.seek(0)
+        await asyncio.to_thread(_add_member, tar, "summary.txt", spool, len(data))
+    await asyncio.to_thread(tar.close)
+    return result
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import hmac
+import logging
+import re
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import quote, urlsplit
+
+import httpx
+
+
+# ================== Клиент S3 (SigV4, path-style) ==================
+# Минимальная реализация multipart upload для S3-совместимых хранилищ (MinIO, AWS и т.п.)
+# поверх httpx, который уже есть в зависимостях python-telegram-bot.
+
+class S3Error(Exception):
+    pass
+
+
+def _sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+
+class S3Client:
+    def __init__(self, endpoint: str, access_key: str, secret_key: str, bucket: str,
+                 region: str = "us-east-1", timeout: float = 120.0):
+        self.endpoint = endpoint.rstrip('/')
+        self.host = urlsplit(self.endpoint).netloc
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket = bucket
+        self.region = region
+        self._http = httpx.AsyncClient(timeout=timeout)
+
+    async def close(self):
+        await self._http.aclose()
+
+    def _sign(self, method: str, path: str, query: dict, payload_hash: str) -> dict:
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date = now.strftime('%Y%m%d')
+        scope = f"{date}/{self.region}/s3/aws4_request"
+
+        canonical_query = '&'.join(
+            f"{quote(k, safe='-_.~')}={quote(str(v), safe='-_.~')}" for k, v in sorted(query.items())
+        )
+        headers = {'host': self.host, 'x-amz-content-sha256': payload_hash, 'x-amz-date': amz_date}
+        signed_headers = ';'.join(sorted(headers))
+        canonical_headers = ''.join(f"{k}:{headers[k]}\n" for k in sorted(headers))
+        canonical_request = '\n'.join(
+            [method, path, canonical_query, canonical_headers, signed_headers, payload_hash]
+        )
+        string_to_sign = '\n'.join(
+            ['AWS4-HMAC-SHA256', amz_date, scope, _sha256_hex(canonical_request.encode('utf-8'))]
+        )
+
+        key = _hmac(('AWS4' + self.secret_key).encode('utf-8'), date)
+        key = _hmac(key, self.region)
+        key = _hmac(key, 's3')
+        key = _hmac(key, 'aws4_request')
+        signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+        return {
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date,
+            'Authorization': (
+                f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                f"SignedHeaders={signed_headers}, Signature={signature}"
+            ),
+        }
+
+    async def request(self, method: str, key: str, query: Optional[dict] = None, body: bytes = b"") -> httpx.Response:
+        query = query or {}
+        path = '/' + quote(self.bucket, safe='') + '/' + quote(key, safe='/-_.~')
+        headers = self._sign(method, path, query, _sha256_hex(body))
+        response = await self._http.request(
+            method, self.endpoint + path, params=query, headers=headers, content=body
+        )
+        if response.status_code >= 300:
+            raise S3Error(f"S3 {method} {key}: HTTP {response.status_code} {response.text[:300]}")
+        return response
+
+
+# ================== Multipart upload ==================
+
+class S3MultipartUpload:
+    """
+    Потоковая загрузка одного объекта частями.
+
+    write() вызывается из рабочего потока (архивация/шифрование идут в asyncio.to_thread):
+    данные копятся до part_size и отдаются в event loop, где до `concurrency` частей
+    загружаются одновременно. Если все слоты заняты, write() блокируется — в памяти
+    не больше (concurrency + 1) * part_size байт. Каждая часть повторяется до `retries` раз.
+    """
+
+    def __init__(self, client: S3Client, key: str, loop: asyncio.AbstractEventLoop,
+                 part_size: int = 8 * 1024 * 1024, concurrency: int = 4, retries: int = 3):
+        # S3 требует не меньше 5 МБ для всех частей, кроме последней
+        self.client = client
+        self.key = key
+        self.loop = loop
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.retries = max(1, retries)
+        self.upload_id = None
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._part_number = 0
+        self._etags = {}
+        self._tasks = []
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._error = None
+
+    async def start(self):
+        response = await self.client.request('POST', self.key, {'uploads': ''})
+        match = re.search(r'<UploadId>([^<]+)</UploadId>', response.text)
+        if not match:
+            raise S3Error("S3: не получен UploadId")
+        self.upload_id = match.group(1)
+        return self
+
+    # --- Вызываются из рабочего потока ---
+
+    def write(self, data) -> int:
+        if self._error:
+            raise self._error
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit(part)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _submit(self, part: bytes):
+        self._part_number += 1
+        future = asyncio.run_coroutine_threadsafe(self._schedule(self._part_number, part), self.loop)
+        # Ждём свободный слот (обратное давление на архиватор)
+        future.result()
+
+    # --- В event loop ---
+
+    async def _schedule(self, number: int, data: bytes):
+        await self._slots.acquire()
+        self._tasks.append(asyncio.create_task(self._upload_part(number, data)))
+
+    async def _upload_part(self, number: int, data: bytes):
+        try:
+            for attempt in range(1, self.retries + 1):
+                try:
+                    response = await self.client.request(
+                        'PUT', self.key, {'partNumber': number, 'uploadId': self.upload_id}, data
+                    )
+                    self._etags[number] = response.headers.get('ETag', '')
+                    return
+                except (httpx.TransportError, S3Error) as e:
+                    if attempt == self.retries:
+                        self._error = S3Error(f"Часть {number} не загружена после {attempt} попыток: {e}")
+                        raise self._error
+                    delay = 2 ** (attempt - 1)
+                    logging.warning(f"S3: ошибка загрузки части {number} (попытка {attempt}): {e}. Повтор через {delay} сек")
+                    await asyncio.sleep(delay)
+        finally:
+            self._slots.release()
+
+    async def complete(self) -> int:
+        """Отправляет остаток буфера, дожидается всех частей и собирает объект. Возвращает размер."""
+        if self._buffer or self._part_number == 0:
+            self._part_number += 1
+            await self._schedule(self._part_number, bytes(self._buffer))
+            self._buffer.clear()
+        await asyncio.gather(*self._tasks)
+        if self._error:
+            raise self._error
+
+        parts = ''.join(
+            f"<Part><PartNumber>{n}</PartNumber><ETag>{self._etags[n]}</ETag></Part>"
+            for n in sorted(self._etags)
+        )
+        body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode('utf-8')
+        response = await self.client.request('POST', self.key, {'uploadId': self.upload_id}, body)
+        # S3 может вернуть ошибку в теле ответа с кодом 200
+        if '<Error>' in response.text:
+            raise S3Error(f"S3: ошибка завершения загрузки: {response.text[:300]}")
+        return self.bytes_written
+
+    async def abort(self):
+        """Отменяет загрузку: незавершённые части удаляются из хранилища."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.upload_id:
+            try:
+                await self.client.request('DELETE', self.key, {'uploadId': self.upload_id})
+            except Exception as e:
+                logging.warning(f"S3: не удалось отменить загрузку {self.key}: {e}")
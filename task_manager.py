@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import itertools
+import logging
+import time
+import weakref
+from typing import Optional
+
+
+# ================== Фоновые задачи ==================
+# Долгие операции (архивация, "перезапустить все" и т.п.) выполняются как asyncio-задачи
+# с номером, текущим статусом и возможностью отмены, не блокируя обработку других кнопок.
+
+class BackgroundTask:
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, task_id: int, title: str, chat_id: Optional[int], message_id: Optional[int] = None):
+        self.id = task_id
+        self.title = title
+        self.chat_id = chat_id
+        self.message_id = message_id  # сообщение, в котором показывается ход и результат задачи
+        self.state = self.RUNNING
+        self.status = "⏳ Запуск..."
+        self.started = time.monotonic()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self.state == self.RUNNING
+
+    @property
+    def elapsed(self) -> int:
+        return int((self.finished or time.monotonic()) - self.started)
+
+    def set_status(self, status: str):
+        """Обновляет текст статуса (вызывается самой задачей по ходу работы)."""
+        self.status = status
+
+
+class TaskManager:
+    def __init__(self, keep_finished: int = 20):
+        self._ids = itertools.count(1)
+        self._tasks = {}
+        self.keep_finished = keep_finished
+
+    def start(self, title: str, coro_factory, chat_id: Optional[int] = None,
+              message_id: Optional[int] = None) -> BackgroundTask:
+        """
+        Запускает фоновую задачу. coro_factory(task) возвращает корутину;
+        task передаётся, чтобы корутина могла обновлять статус через task.set_status().
+        """
+        task = BackgroundTask(next(self._ids), title, chat_id, message_id)
+        task._task = asyncio.create_task(self._run(task, coro_factory))
+        self._tasks[task.id] = task
+        self._cleanup()
+        logging.info(f"▶️ Задача #{task.id} запущена: {title}")
+        return task
+
+    async def _run(self, task: BackgroundTask, coro_factory):
+        try:
+            task.result = await coro_factory(task)
+            task.state = BackgroundTask.DONE
+        except asyncio.CancelledError:
+            task.state = BackgroundTask.CANCELLED
+            task.status = "🚫 Отменена"
+        except Exception as e:
+            task.state = BackgroundTask.FAILED
+            task.error = e
+            task.status = f"❌ Ошибка: {e}"
+            logging.error(f"Задача #{task.id} ({task.title}) завершилась с ошибкой: {e}")
+        finally:
+            task.finished = time.monotonic()
+            logging.info(f"⏹ Задача #{task.id} ({task.title}): {task.state} за {task.elapsed} сек")
+
+    def get(self, task_id: int) -> Optional[BackgroundTask]:
+        return self._tasks.get(task_id)
+
+    def list(self, running_only: bool = False) -> list:
+        tasks = sorted(self._tasks.values(), key=lambda t: t.id)
+        return [t for t in tasks if t.running] if running_only else tasks
+
+    def cancel(self, task_id: int) -> bool:
+        task = self._tasks.get(task_id)
+        if not task or not task.running:
+            return False
+        task._task.cancel()
+        return True
+
+    async def wait(self, task_id: int, timeout: float) -> bool:
+        """Ждёт завершения задачи не дольше timeout. Возвращает True, если задача завершилась."""
+        task = self._tasks.get(task_id)
+        if not task:
+            return True
+        done, _ = await asyncio.wait([task._task], timeout=timeout)
+        return bool(done)
+
+    async def shutdown(self):
+        running = [t._task for t in self._tasks.values() if t.running]
+        for t in running:
+            t.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    def _cleanup(self):
+        finished = [t for t in self.list() if not t.running]
+        for task in finished[:-self.keep_finished] if self.keep_finished else finished:
+            self._tasks.pop(task.id, None)
+
+
+class MessageLocks:
+    """
+    Блокировки по ключу (chat_id, message_id): нажатия на одно и то же сообщение
+    обрабатываются по очереди, разные сообщения и чаты — параллельно.
+    Неиспользуемые блокировки удаляются автоматически (weakref).
+    """
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()
+
+    def get(self, chat_id, message_id) -> asyncio.Lock:
+        key = (chat_id, message_id)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
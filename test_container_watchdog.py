@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+
+from container_watchdog import ContainerWatchdog
+
+
+class _FakeContainer:
+    """Контейнер, который падает через `crash_after` сек после каждого перезапуска."""
+
+    def __init__(self, watchdog, loop, name="app", crash_after=0.2):
+        self.watchdog = watchdog
+        self.loop = loop
+        self.name = name
+        self.crash_after = crash_after
+        self.status = "exited"
+        self.attrs = {"State": {}}
+        self.restarts = 0
+        self.timers = []
+
+    def _emit(self, action):
+        event = {
+            "Action": action,
+            "timeNano": time.time_ns(),
+            "Actor": {"Attributes": {"name": self.name, "exitCode": "1"}},
+        }
+        try:
+            self.loop.call_soon_threadsafe(self.watchdog._on_event, event)
+        except RuntimeError:
+            # Тест уже завершён, event loop закрыт
+            pass
+
+    def _crash(self):
+        self.status = "exited"
+        self._emit("die")
+
+    def restart(self):
+        # docker restart: остановка (stop + die) и новый запуск
+        self.restarts += 1
+        self._emit("die")
+        self._emit("stop")
+        time.sleep(0.05)
+        self.status = "running"
+        timer = threading.Timer(self.crash_after, self._crash)
+        self.timers.append(timer)
+        timer.start()
+
+    def cancel_timers(self):
+        for timer in self.timers:
+            timer.cancel()
+
+    def stop(self):
+        self._emit("die")
+        self._emit("stop")
+        time.sleep(0.05)
+        self.status = "exited"
+
+    def logs(self, tail):
+        return b"boom\n"
+
+
+class _FakeContainers:
+    def __init__(self):
+        self.container = None
+
+    def get(self, name):
+        return self.container
+
+
+class _FakeClient:
+    def __init__(self):
+        self.containers = _FakeContainers()
+
+
+def _make_watchdog():
+    client = _FakeClient()
+    watchdog = ContainerWatchdog(
+        client, bot=None, chat_id=0,
+        backoff_base=0.05, backoff_max=0.05,
+        crashloop_restarts=3, crashloop_window=60,
+        stable_seconds=30, grace_seconds=0.05,
+    )
+    watchdog._loop = asyncio.get_running_loop()
+    container = _FakeContainer(watchdog, watchdog._loop)
+    client.containers.container = container
+    return watchdog, container
+
+
+def test_crash_after_restart_trips_crash_loop():
+    async def scenario():
+        watchdog, container = _make_watchdog()
+
+        container._crash()
+        try:
+            for _ in range(100):
+                await asyncio.sleep(0.05)
+                incident = watchdog._incidents.get(container.name)
+                if incident and incident.crash_loop:
+                    break
+            incident = watchdog._incidents.get(container.name)
+            state = watchdog._state(container.name)
+
+            # Каждое падение после перезапуска учтено, а падения внутри restart() — нет
+            assert incident is not None and incident.crash_loop
+            assert container.restarts == watchdog.crashloop_restarts - 1
+            assert len(state.dies) == watchdog.crashloop_restarts
+        finally:
+            container.cancel_timers()
+            await watchdog.stop()
+
+    asyncio.run(scenario())
+
+
+def test_crash_after_manual_restart_is_handled():
+    async def scenario():
+        watchdog, container = _make_watchdog()
+        container.crash_after = 0.1
+
+        # Перезапуск через бота: его собственные die/stop ожидаемы, падение после — нет
+        with watchdog.manual_action(container.name):
+            await asyncio.to_thread(container.restart)
+        try:
+            for _ in range(40):
+                await asyncio.sleep(0.05)
+                if container.restarts > 1:
+                    break
+            assert container.name in watchdog._incidents
+            assert container.restarts > 1
+        finally:
+            container.cancel_timers()
+            await watchdog.stop()
+
+    asyncio.run(scenario())
+
+
+def test_manual_stop_is_not_restarted():
+    async def scenario():
+        watchdog, container = _make_watchdog()
+        container.status = "running"
+
+        with watchdog.manual_action(container.name, stop=True):
+            await asyncio.to_thread(container.stop)
+        try:
+            await asyncio.sleep(0.5)
+            assert container.name not in watchdog._incidents
+            assert container.restarts == 0
+            assert not watchdog._state(container.name).dies
+        finally:
+            container.cancel_timers()
+            await watchdog.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import logging
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional
+
+
+# ================== Правила исключений (gitignore-стиль) ==================
+
+def _translate_glob(pattern: str) -> str:
+    """Переводит glob gitignore (*, ?, **, [...]) в регулярное выражение."""
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern[i:i + 3] == '**/':
+                # "**/" — ноль или больше каталогов
+                res.append('(?:.*/)?')
+                i += 3
+                continue
+            if pattern[i:i + 2] == '**':
+                res.append('.*')
+                i += 2
+                continue
+            res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            # Как в git: ']' сразу после '[' (или '[!') — обычный символ набора;
+            # незакрытая скобка — литерал '['
+            start = i + 1
+            if pattern[start:start + 1] == '!':
+                start += 1
+            j = pattern.find(']', start + 1 if pattern[start:start + 1] == ']' else start)
+            if j == -1:
+                res.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                body = body.replace('\\', '\\\\').replace('[', '\\[')
+                if body.startswith('^]') or body.startswith(']'):
+                    body = body.replace(']', '\\]', 1)
+                res.append('[' + body + ']')
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            res.append(re.escape(pattern[i]))
+        else:
+            res.append(re.escape(c))
+        i += 1
+    return ''.join(res)
+
+
+class ExcludeMatcher:
+    """
+    Набор правил в стиле .gitignore, скомпилированный в одно регулярное выражение.
+
+    Поддерживается: '#' комментарии, '!' (повторное включение), '/' в начале (привязка к корню),
+    '/' в конце (только каталоги), '*', '?', '**', '[...]'. Как и в git, побеждает последнее
+    совпавшее правило, а содержимое исключённого каталога не сканируется.
+    """
+
+    def __init__(self, patterns):
+        self.rules = []
+        for raw in patterns:
+            line = raw.strip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.strip('/') if dir_only else line
+            if not line:
+                continue
+            # Шаблон без '/' внутри совпадает на любом уровне, иначе — от корня
+            anchored = raw.strip().lstrip('!').startswith('/') or '/' in line
+            line = line.lstrip('/')
+            regex = _translate_glob(line)
+            if not anchored:
+                regex = '(?:.*/)?' + regex
+            # Проверяем каждое правило отдельно: одна ошибка в строке (например, "[z-a]")
+            # не должна ломать общее выражение, а с ним — и все бэкапы
+            try:
+                re.compile(regex)
+            except re.error as e:
+                logging.warning(f"Правило исключения пропущено (ошибка в шаблоне {raw.strip()!r}: {e})")
+                continue
+            self.rules.append((regex, negate, dir_only))
+
+        self._file_re = self._compile(dirs=False)
+        self._dir_re = self._compile(dirs=True)
+
+    def _compile(self, dirs: bool):
+        # Альтернативы в обратном порядке: первая совпавшая = последнее правило в списке
+        parts = []
+        for index in range(len(self.rules) - 1, -1, -1):
+            regex, _, dir_only = self.rules[index]
+            if dir_only and not dirs:
+                continue
+            parts.append(f'(?P<r{index}>{regex})')
+        if not parts:
+            return None
+        return re.compile('(?:' + '|'.join(parts) + r')\Z', re.DOTALL)
+
+    def is_excluded(self, rel_path: str, is_dir: bool = False) -> bool:
+        """rel_path — путь относительно корня с разделителем '/'."""
+        compiled = self._dir_re if is_dir else self._file_re
+        if compiled is None:
+            return False
+        match = compiled.match(rel_path)
+        if not match:
+            return False
+        _, negate, _ = self.rules[int(match.lastgroup[1:])]
+        return not negate
+
+
+def load_exclude_patterns(root: str, env_value: str = "", ignore_file: Optional[str] = None) -> list:
+    """Собирает правила: из переменной окружения (через запятую), затем из файла игнора."""
+    patterns = [p for p in env_value.split(',') if p.strip()]
+    path = ignore_file or os.path.join(root, '.backupignore')
+    if os.path.isfile(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                patterns.extend(f.read().splitlines())
+        except OSError as e:
+            logging.warning(f"Не удалось прочитать файл исключений {path}: {e}")
+    return patterns
+
+
+# ================== Сканирование дерева ==================
+
+class ScanResult:
+    """Список файлов для архивации и его итоговый размер (один проход по дереву)."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.files = []   # (абсолютный путь, относительный путь, размер)
+        self.dirs = []    # относительные пути каталогов (в т.ч. пустых)
+        self.total_bytes = 0
+        self.excluded_count = 0
+        self.errors = []
+
+    @property
+    def file_count(self) -> int:
+        return len(self.files)
+
+
+def _scan_dir(root: str, rel_dir: str, matcher: ExcludeMatcher):
+    """Читает один каталог. Возвращает (файлы, подкаталоги для обхода, символьные ссылки на каталоги, исключено)."""
+    files, subdirs, linked_dirs = [], [], []
+    excluded = 0
+    path = os.path.join(root, rel_dir) if rel_dir else root
+    with os.scandir(path) as it:
+        for entry in it:
+            rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if matcher.is_excluded(rel, is_dir=True):
+                        excluded += 1
+                    else:
+                        subdirs.append(rel)
+                    continue
+                if entry.is_dir():
+                    # Ссылку на каталог не обходим (как shutil.make_archive), сохраняем как каталог
+                    if not matcher.is_excluded(rel, is_dir=True):
+                        linked_dirs.append(rel)
+                    continue
+                if not entry.is_file():
+                    continue
+                if matcher.is_excluded(rel):
+                    excluded += 1
+                    continue
+                files.append((entry.path, rel, entry.stat().st_size))
+            except OSError as e:
+                logging.warning(f"Пропуск {entry.path}: {e}")
+    return files, subdirs, linked_dirs, excluded
+
+
+def scan_tree(root: str, patterns=(), max_workers: Optional[int] = None) -> ScanResult:
+    """
+    Обходит дерево через os.scandir параллельно по подкаталогам и применяет правила исключений.
+    Каждый каталог читается ровно один раз; результат передаётся архиватору.
+    """
+    matcher = patterns if isinstance(patterns, ExcludeMatcher) else ExcludeMatcher(patterns)
+    result = ScanResult(root)
+    workers = max_workers or min(8, (os.cpu_count() or 1) * 2)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_scan_dir, root, "", matcher): ""}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_dir = pending.pop(future)
+                try:
+                    files, subdirs, linked_dirs, excluded = future.result()
+                except OSError as e:
+                    logging.warning(f"Не удалось прочитать каталог {rel_dir or root}: {e}")
+                    result.errors.append((rel_dir, str(e)))
+                    continue
+                result.files.extend(files)
+                result.total_bytes += sum(size for _, _, size in files)
+                result.excluded_count += excluded
+                result.dirs.extend(linked_dirs)
+                for sub in subdirs:
+                    result.dirs.append(sub)
+                    pending[pool.submit(_scan_dir, root, sub, matcher)] = sub
+
+    # Детерминированный порядок в архиве
+    result.files.sort(key=lambda item: item[1])
+    result.dirs.sort()
+    return result
+
+
+# ================== Архивация ==================
+
+def write_zip(scan: ScanResult, fileobj, base_dir: Optional[str] = None) -> int:
+    """
+    Пишет ZIP (deflate) по готовому списку файлов, без повторного обхода дерева.
+    Пути внутри архива начинаются с base_dir (по умолчанию — имя корневой папки),
+    как у shutil.make_archive. Возвращает число записанных файлов.
+    """
+    base_dir = base_dir if base_dir is not None else os.path.basename(os.path.normpath(scan.root))
+    prefix = f"{base_dir}/" if base_dir else ""
+    written = 0
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        if prefix:
+            zf.write(scan.root, prefix)
+        for rel in scan.dirs:
+            try:
+                zf.write(os.path.join(scan.root, rel), prefix + rel + '/')
+            except OSError as e:
+                logging.warning(f"Пропуск каталога {rel}: {e}")
+        for path, rel, _ in scan.files:
+            try:
+                zf.write(path, prefix + rel)
+                written += 1
+            except OSError as e:
+                # Файл мог исчезнуть между сканированием и архивацией
+                logging.warning(f"Пропуск файла {rel}: {e}")
+    return written
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import hmac
+import json
+import logging
+import ssl
+from typing import Optional
+
+
+# ================== Встроенный HTTP-сервер для webhook ==================
+# Минимальный HTTP/1.1 сервер на asyncio.start_server: работает в том же event loop,
+# что и планировщик и задачи Docker, и не тянет дополнительных зависимостей.
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class WebhookServer:
+    """
+    Принимает POST с JSON-обновлением на `path`, проверяет заголовок
+    X-Telegram-Bot-Api-Secret-Token и передаёт разобранный JSON в `handler` (async).
+    GET /healthz отвечает 200 — для проверки живости и reverse proxy.
+    """
+
+    def __init__(self, handler, host: str = "0.0.0.0", port: int = 8080, path: str = "/telegram",
+                 secret_token: str = "", ssl_context: Optional[ssl.SSLContext] = None,
+                 max_body: int = 1024 * 1024, read_timeout: float = 10):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.path = path if path.startswith('/') else '/' + path
+        self.secret_token = secret_token
+        self.ssl_context = ssl_context
+        self.max_body = max_body
+        self.read_timeout = read_timeout
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, ssl=self.ssl_context)
+        logging.info(f"🌐 Webhook-сервер слушает {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            return None, None, None
+        method, target, _ = parts
+
+        headers = {}
+        for _ in range(100):
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return method, target.split('?', 1)[0], headers
+
+    async def _handle(self, reader, writer):
+        status = 500
+        try:
+            method, path, headers = await asyncio.wait_for(self._read_request(reader), self.read_timeout)
+            if method is None:
+                status = 400
+            elif method == 'GET' and path == '/healthz':
+                status = 200
+            elif path != self.path:
+                status = 404
+            elif method != 'POST':
+                status = 405
+            elif not hmac.compare_digest(
+                headers.get('x-telegram-bot-api-secret-token', '').encode('utf-8'),
+                self.secret_token.encode('utf-8')
+            ):
+                logging.warning("Webhook: запрос с неверным secret token отклонён")
+                status = 403
+            else:
+                length = int(headers.get('content-length', '0') or 0)
+                if length <= 0:
+                    status = 400
+                elif length > self.max_body:
+                    status = 413
+                else:
+                    body = await asyncio.wait_for(reader.readexactly(length), self.read_timeout)
+                    try:
+                        data = json.loads(body)
+                    except ValueError:
+                        status = 400
+                    else:
+                        # handler только ставит обновление в очередь — отвечаем Telegram сразу
+                        await self.handler(data)
+                        status = 200
+        except asyncio.TimeoutError:
+            status = 408
+        except (ValueError, asyncio.IncompleteReadError):
+            status = 400
+        except Exception as e:
+            logging.error(f"Webhook: ошибка обработки запроса: {e}")
+            status = 500
+
+        try:
+            reason = _REASONS.get(status, "")
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode('latin-1')
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()